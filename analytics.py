@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import threading
+import traceback
+from itertools import chain
+from sqlalchemy import select, func
+from models import db, Attribute, Perk, LeaderboardEntry, ArchivedLife
+from archive import decompress
+
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", 300))
+ANALYTICS_LOAD_BATCH = 50000
+ATTRIBUTE_NAMES = ('health', 'wealth', 'happiness', 'karma', 'iq')
+ATTRIBUTE_DEFAULTS = {'health': 100, 'wealth': 500, 'happiness': 75, 'karma': 0, 'iq': 100}
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+TRAJECTORY_PERCENTILES = (10, 50, 90)
+SCORE_HISTOGRAM_BINS = 20
+ATTRIBUTE_COLUMNS = ('id', 'character_id', 'year') + ATTRIBUTE_NAMES
+
+np = None # NumPy is imported by the first load(), so processes that never build the report don't pay for it
+
+
+def _fetch(conn, statement, columns):
+    # Streams an integer-only select into one array per column, without building a Python object per row.
+    arrays = {name: [] for name in columns}
+    for part in conn.execute(statement).partitions(ANALYTICS_LOAD_BATCH):
+        block = np.fromiter(chain.from_iterable(part), dtype=np.int64, count=len(part) * len(columns)).reshape(-1, len(columns))
+        for i, name in enumerate(columns): arrays[name].append(block[:, i])
+    return {name: np.concatenate(parts) if parts else np.empty(0, np.int64) for name, parts in arrays.items()}
+
+def _grouped_percentiles(groups, values, group_count, percentiles):
+    # Lower nearest-rank percentiles of integer values within each group 0..group_count-1, all groups at once:
+    # one sort of group * span + value, then an index into each group's run. Empty groups give NaN.
+    low = int(values.min()) if len(values) else 0
+    span = (int(values.max()) - low + 1) if len(values) else 1
+    sorted_values = (np.sort(groups * span + (values - low)) % span + low).astype(float)
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = {}
+    for p in percentiles:
+        index = starts + np.floor(p / 100 * np.maximum(counts - 1, 0)).astype(np.int64)
+        picked = sorted_values[np.minimum(index, max(len(sorted_values) - 1, 0))] if len(sorted_values) else np.zeros(group_count)
+        result[p] = np.where(counts > 0, picked, np.nan)
+    return result
+
+def _grouped_means(groups, values, group_count):
+    counts = np.bincount(groups, minlength=group_count)
+    sums = np.bincount(groups, weights=values.astype(float), minlength=group_count)
+    with np.errstate(invalid='ignore', divide='ignore'): return np.where(counts > 0, sums / counts, np.nan)
+
+def _json(values, digits=2):
+    return [None if np.isnan(v) else round(float(v), digits) for v in np.asarray(values, dtype=float)]
+
+
+class PopulationAnalytics:
+    # Columnar copies of the Attribute, Perk and LeaderboardEntry tables and of the lives archived out of them,
+    # loaded incrementally from each table's highest id seen so far, and the balancing report computed from them
+    # with NumPy. The report is cached: report() hands out the last one and refreshes it in a background thread
+    # once it is older than ANALYTICS_REFRESH_SECONDS, so no request waits on a refresh except the very first.
+    def __init__(self, app=None, refresh_interval=ANALYTICS_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.attributes = None # column name -> array, from the first load()
+        self.perks = None
+        self.perk_names = []
+        self.deaths = {} # character_id -> (age, score), as recorded on the leaderboard
+        self.high_water = {'attribute': 0, 'perk': 0, 'leaderboard': 0, 'archive': 0}
+        self.cached, self.cached_at = None, 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['analytics'] = self
+
+    # --- Loading ---
+    def load(self):
+        # Pulls rows added since the last load, all inside one read transaction so the tables agree with each other.
+        # Returns how many rows of each table arrived.
+        global np
+        if np is None: import numpy as np
+        if self.attributes is None:
+            self.attributes = {name: np.empty(0, np.int64) for name in ATTRIBUTE_COLUMNS}
+            self.perks = {'character_id': np.empty(0, np.int64), 'code': np.empty(0, np.int64)}
+        with db.engine.connect() as conn:
+            attribute_columns = [Attribute.id, Attribute.character_id, Attribute.year] + [func.coalesce(getattr(Attribute, name), ATTRIBUTE_DEFAULTS[name]) for name in ATTRIBUTE_NAMES]
+            new_attributes = _fetch(conn, select(*attribute_columns).where(Attribute.id > self.high_water['attribute']).order_by(Attribute.id), list(self.attributes))
+
+            perk_rows = conn.execute(select(Perk.id, Perk.character_id, Perk.name).where(Perk.id > self.high_water['perk']).order_by(Perk.id)).all()
+            death_rows = conn.execute(select(LeaderboardEntry.id, LeaderboardEntry.character_id, LeaderboardEntry.age, LeaderboardEntry.score)
+                                      .where(LeaderboardEntry.id > self.high_water['leaderboard']).order_by(LeaderboardEntry.id)).all()
+
+            archive_rows = conn.execute(select(ArchivedLife.id, ArchivedLife.character_id, ArchivedLife.codec, ArchivedLife.data)
+                                        .where(ArchivedLife.id > self.high_water['archive']).order_by(ArchivedLife.id)).all()
+
+            # A death by event zeroes health on the character's latest row, which may have been loaded already.
+            newly_dead = [row.character_id for row in death_rows if row.character_id not in self.deaths]
+            zeroed = []
+            for start in range(0, len(newly_dead), 500):
+                zeroed += conn.execute(select(Attribute.id).where(Attribute.character_id.in_(newly_dead[start:start + 500]), Attribute.id <= self.high_water['attribute'], Attribute.health == 0)).scalars().all()
+
+        if len(new_attributes['id']):
+            for name in self.attributes: self.attributes[name] = np.concatenate((self.attributes[name], new_attributes[name]))
+            self.high_water['attribute'] = int(new_attributes['id'][-1])
+        if zeroed:
+            self.attributes['health'][np.isin(self.attributes['id'], zeroed)] = 0
+        codes = {name: i for i, name in enumerate(self.perk_names)}
+        def code(name):
+            if name not in codes: codes[name] = len(self.perk_names); self.perk_names.append(name)
+            return codes[name]
+        if perk_rows:
+            self.perks['character_id'] = np.concatenate((self.perks['character_id'], np.array([row.character_id for row in perk_rows], np.int64)))
+            self.perks['code'] = np.concatenate((self.perks['code'], np.array([code(row.name) for row in perk_rows], np.int64)))
+            self.high_water['perk'] = perk_rows[-1].id
+        if archive_rows:
+            # An archived life replaces whatever of it was loaded from the hot tables, which may be missing rows
+            # written after the last load and deleted by the archiving since.
+            archived_ids = np.array([row.character_id for row in archive_rows], np.int64)
+            keep = ~np.isin(self.attributes['character_id'], archived_ids)
+            keep_perks = ~np.isin(self.perks['character_id'], archived_ids)
+            attribute_parts = {name: [values[keep]] for name, values in self.attributes.items()}
+            perk_parts = {name: [values[keep_perks]] for name, values in self.perks.items()}
+            for row in archive_rows:
+                record = json.loads(decompress(row.codec, row.data))
+                columns = record['attributes']
+                for name in self.attributes:
+                    if name == 'character_id': values = [row.character_id] * len(columns['year'])
+                    elif name in ATTRIBUTE_DEFAULTS: values = [ATTRIBUTE_DEFAULTS[name] if v is None else v for v in columns[name]]
+                    else: values = columns[name]
+                    attribute_parts[name].append(np.array(values, np.int64))
+                perk_parts['character_id'].append(np.full(len(record['perks']), row.character_id, np.int64))
+                perk_parts['code'].append(np.array([code(name) for name in record['perks']], np.int64))
+            self.attributes = {name: np.concatenate(parts) for name, parts in attribute_parts.items()}
+            self.perks = {name: np.concatenate(parts) for name, parts in perk_parts.items()}
+            self.high_water['archive'] = archive_rows[-1].id
+        if death_rows:
+            # rebuild_leaderboard re-adds every entry under new ids; keyed by character, the newest copy wins.
+            self.deaths.update((row.character_id, (row.age, row.score)) for row in death_rows)
+            self.high_water['leaderboard'] = death_rows[-1].id
+        return {'attribute': len(new_attributes['id']), 'perk': len(perk_rows), 'leaderboard': len(death_rows), 'archive': len(archive_rows)}
+
+    # --- Report ---
+    def compute(self):
+        a = self.attributes
+        # One entry per character that has lived at least one year; a failed creation leaves perks but no attributes.
+        characters, character_index = np.unique(a['character_id'], return_inverse=True)
+        n = len(characters)
+        if n == 0: return {'lives': 0}
+
+        # Each character's latest row: sort by (character, year) and keep the last of every run.
+        order = np.lexsort((a['year'], character_index))
+        last = order[np.r_[character_index[order][1:] != character_index[order][:-1], True]]
+        final = {name: a[name][last] for name in ATTRIBUTE_NAMES}
+
+        death_ids = np.fromiter(self.deaths.keys(), np.int64, len(self.deaths))
+        death_values = np.array(list(self.deaths.values()), np.int64).reshape(-1, 2)
+        position = np.searchsorted(characters, death_ids)
+        known = (position < n) & (characters[np.minimum(position, n - 1)] == death_ids)
+        dead = np.zeros(n, bool); dead[position[known]] = True
+        score = np.full(n, -1, np.int64); score[position[known]] = death_values[known, 1]
+        # Dead lives end at their recorded age; the living are censored at the last year they reached.
+        lifespan = a['year'][last].copy(); lifespan[position[known]] = death_values[known, 0]
+        lifespan = np.maximum(lifespan, 0)
+
+        # Group 0 is everyone, group g+1 the characters holding perk g.
+        perk_position = np.searchsorted(characters, self.perks['character_id'])
+        holds = (perk_position < n) & (characters[np.minimum(perk_position, n - 1)] == self.perks['character_id'])
+        member = np.concatenate((np.arange(n), perk_position[holds]))
+        group = np.concatenate((np.zeros(n, np.int64), self.perks['code'][holds] + 1))
+        groups = len(self.perk_names) + 1
+
+        # Kaplan-Meier: at risk at age x are lives that reached x; the hazard is deaths at x over those at risk.
+        ages = int(lifespan.max()) + 1
+        ended = np.bincount(group * ages + lifespan[member], minlength=groups * ages).reshape(groups, ages)
+        died = np.bincount(group * ages + lifespan[member], weights=dead[member], minlength=groups * ages).reshape(groups, ages)
+        at_risk = np.cumsum(ended[:, ::-1], axis=1)[:, ::-1]
+        with np.errstate(invalid='ignore', divide='ignore'): hazard = np.where(at_risk > 0, died / at_risk, 0.0)
+        survival = np.cumprod(1 - hazard, axis=1)
+        # Mean lifespan restricted to the oldest age seen: the area under the survival curve.
+        life_expectancy = survival.sum(axis=1)
+        below_half = survival <= 0.5
+        median_lifespan = np.where(below_half.any(axis=1), below_half.argmax(axis=1), np.nan)
+
+        lives, deaths = np.bincount(group, minlength=groups), np.bincount(group, weights=dead[member], minlength=groups)
+        scored = dead[member] & (score[member] >= 0)
+        score_groups, score_values = group[scored], score[member][scored]
+        score_percentiles = _grouped_percentiles(score_groups, score_values, groups, PERCENTILES)
+        mean_score = _grouped_means(score_groups, score_values, groups)
+        edges = np.histogram_bin_edges(score_values if len(score_values) else np.zeros(1), bins=SCORE_HISTOGRAM_BINS)
+        bins = np.clip(np.searchsorted(edges, score_values, side='right') - 1, 0, SCORE_HISTOGRAM_BINS - 1)
+        histograms = np.bincount(score_groups * SCORE_HISTOGRAM_BINS + bins, minlength=groups * SCORE_HISTOGRAM_BINS).reshape(groups, SCORE_HISTOGRAM_BINS)
+        final_means = {name: _grouped_means(group, values[member], groups) for name, values in final.items()}
+
+        # Attribute trajectories by age over every row loaded.
+        year = np.maximum(a['year'], 0)
+        trajectory_ages = int(year.max()) + 1
+        trajectories = {}
+        for name in ATTRIBUTE_NAMES:
+            quantiles = _grouped_percentiles(year, a[name], trajectory_ages, TRAJECTORY_PERCENTILES)
+            trajectories[name] = dict({'mean': _json(_grouped_means(year, a[name], trajectory_ages))}, **{f"p{p}": _json(quantiles[p]) for p in TRAJECTORY_PERCENTILES})
+
+        def summary(g):
+            return {
+                'lives': int(lives[g]), 'deaths': int(deaths[g]),
+                'life_expectancy': round(float(life_expectancy[g]), 2),
+                'median_lifespan': None if np.isnan(median_lifespan[g]) else int(median_lifespan[g]),
+                'mean_score': _json([mean_score[g]])[0],
+                'score_percentiles': {f"p{p}": _json([score_percentiles[p][g]])[0] for p in PERCENTILES},
+                'score_histogram': histograms[g].tolist(),
+                'mean_final_attributes': {name: _json([final_means[name][g]])[0] for name in ATTRIBUTE_NAMES}
+            }
+
+        population = summary(0)
+        perks = {}
+        for code, name in enumerate(self.perk_names):
+            perks[name] = summary(code + 1)
+            # How far the perk moves each outcome from the population, the number balancing looks at.
+            perks[name]['vs_population'] = {
+                'life_expectancy': round(perks[name]['life_expectancy'] - population['life_expectancy'], 2),
+                'mean_score': None if perks[name]['mean_score'] is None or population['mean_score'] is None else round(perks[name]['mean_score'] - population['mean_score'], 2)
+            }
+        return {
+            'lives': n, 'attribute_rows': len(a['id']),
+            'population': population, 'perks': dict(sorted(perks.items(), key=lambda item: -item[1]['lives'])),
+            'score_histogram_edges': _json(edges, 1),
+            'survival': {'ages': ages, 'population': _json(survival[0], 4), 'perks': {name: _json(survival[code + 1], 4) for code, name in enumerate(self.perk_names)}},
+            'trajectories': {'ages': trajectory_ages, **trajectories}
+        }
+
+    def refresh(self):
+        with self._load_lock:
+            started = time.perf_counter()
+            loaded = self.load()
+            loaded_at = time.perf_counter()
+            report = self.compute()
+        report['refresh'] = {
+            'refreshed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'new_rows': loaded,
+            'load_ms': round((loaded_at - started) * 1000, 1), 'compute_ms': round((time.perf_counter() - loaded_at) * 1000, 1)
+        }
+        with self._lock:
+            self.cached, self.cached_at = report, time.monotonic()
+        return report
+
+    def _refresh_in_background(self):
+        try:
+            with self.app.app_context(): self.refresh()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._lock: self._refreshing = False
+
+    def report(self):
+        with self._lock:
+            cached, stale = self.cached, time.monotonic() - self.cached_at >= self.refresh_interval
+            start_refresh = cached is not None and stale and not self._refreshing
+            if start_refresh: self._refreshing = True
+        if cached is None: return self.refresh()
+        if start_refresh: threading.Thread(target=self._refresh_in_background, name='analytics-refresh', daemon=True).start()
+        return cached
@@ -1,486 +1,365 @@
 import os
 import random
 import json
-import math
-from flask import Flask, render_template, request, redirect, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
-from werkzeug.security import generate_password_hash, check_password_hash
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-# --- App Configuration ---
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'a-super-secret-key-that-is-hard-to-guess'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///life_simulator.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# --- Database and Login Manager Initialization ---
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-
-# --- Gemini API Configuration ---
-GEMINI_API_KEYS = os.getenv("GEMINI_API_KEYS", "").split(',')
-api_key_index = 0
-
-if not all(GEMINI_API_KEYS) or GEMINI_API_KEYS == ['']:
-    print("WARNING: Gemini API keys not found or are empty in .env file. The application may not function correctly.")
-
-# --- Game Constants ---
-ALL_PERKS = [
-    "Genius Intellect",
-    "Artistic Talent",
-    "Athletic Prowess",
-    "Charismatic Leader",
-    "Financial Mogul",
-    "Kind Heart",
-    "Resilient Body",
-    "Lucky Charm",
-    "Inventive Mind",
-    "Musical Prodigy",
-    "Master Negotiator",
-    "Photographic Memory",
-    "Night Owl Focus",
-    "Early Riser Energy",
-    "Perpetual Optimism",
-    "Skeptical Mind",
-    "Silver Tongue",
-    "Stone Cold Poker Face",
-    "Pack Rat Tendencies",
-    "Minimalist Lifestyle",
-    "Master Chef Skills",
-    "Gardening Green Thumb",
-    "DIY Handyman",
-    "Tech Savvy",
-    "Analog Lover",
-    "Boundless Curiosity",
-    "Commitment Phobe",
-    "Eternal Student",
-    "Natural Therapist",
-    "Cold-Blooded Calm",
-    "Hot-Temper Burst",
-    "Chronic Procrastination",
-    "Deadline Crusher",
-    "Serial Hobbyist",
-    "Collector's Eye",
-    "Travel Junkie",
-    "Homebody Comfort",
-    "Social Butterfly",
-    "Introvert Recharge",
-    "Photographer's Eye",
-    "Slow and Steady",
-    "Speed Demon",
-    "Perceptive Observer",
-    "Absent-Minded Professor",
-    "Wallflower Charm",
-    "Spotlight Seeker",
-    "Coincidence Magnet",
-    "Conspiracy Theorist",
-    "Lucky Penny Finder",
-    "Jinxed Luck",
-    "Silver Lining Finder",
-    "Perfectionist Tendencies",
-    "Happy-Go-Lucky",
-    "Blunt Honesty",
-    "White Lie Expert",
-    "Master of Small Talk",
-    "Deep Conversationalist",
-    "Emotionally Intuitive",
-    "Emotionally Reserved",
-    "Night Vision",
-    "Daydream Weaver",
-    "Memory Like a Sieve",
-    "Eidetic Recall",
-    "Street Smart",
-    "Book Smart",
-    "Natural Leader",
-    "Reluctant Follower",
-    "Team Player",
-    "Lone Wolf",
-    "Adaptive Chameleon",
-    "Stubborn as Ox",
-    "Flexible Thinker",
-    "Risk Averse",
-    "Gambler's Instinct",
-    "Safety First",
-    "Adrenaline Seeker",
-    "Cautious Investor",
-    "Impulsive Buyer",
-    "Savvy Saver",
-    "Generous Soul",
-    "Miserly Ways",
-    "Prankster Spirit",
-    "Serious Stoic",
-    "Optimized Routine",
-    "Chaotic Energy",
-    "Organizational Guru",
-    "Creative Mess",
-    "Multitasking Pro",
-    "Monotasking Master",
-    "Hyperfocused",
-    "Easily Distracted",
-    "Translator Tongue",
-    "Monolingual Comfort",
-    "Sense of Direction",
-    "Perpetual Lost",
-    "Negotiation Tactician",
-    "Concession Giver",
-    "Fashion Forward",
-    "Fashionably Late",
-    "DIY Medical Kit",
-    "Health Nut",
-    "Fast Healer",
-    "Fragile Constitution",
-    "Logical Analyzer",
-    "Spiritual Seeker",
-    "Animal Whisperer",
-    "Allergic to Pets",
-    "Green Thumb Failure",
-    "Crafty Maker",
-    "Tech-Phobic",
-    "Quick Wit",
-    "Dry Humor"
-]
-
-
-# --- Database Models ---
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False)
-    password_hash = db.Column(db.String(200), nullable=False)
-    characters = db.relationship('Character', backref='player', lazy=True)
-    def set_password(self, password): self.password_hash = generate_password_hash(password)
-    def check_password(self, password): return check_password_hash(self.password_hash, password)
-
-class Character(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
-    gender = db.Column(db.String(50), nullable=False)
-    is_alive = db.Column(db.Boolean, default=True, nullable=False)
-    age = db.Column(db.Integer, default=0)
-    score = db.Column(db.Integer, default=0)
-    events = db.relationship('LifeEvent', backref='character', lazy=True, cascade="all, delete-orphan")
-    attributes = db.relationship('Attribute', backref='character', lazy=True, cascade="all, delete-orphan")
-    perks = db.relationship('Perk', backref='character', lazy=True, cascade="all, delete-orphan")
-    choices = db.relationship('Choice', backref='character', lazy=True, cascade="all, delete-orphan")
-    achievements = db.relationship('Achievement', backref='character', lazy=True, cascade="all, delete-orphan")
-
-class LifeEvent(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
-    year = db.Column(db.Integer, nullable=False)
-    summary = db.Column(db.Text, nullable=False)
-
-class Attribute(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
-    year = db.Column(db.Integer, nullable=False)
-    health = db.Column(db.Integer, default=100)
-    wealth = db.Column(db.BigInteger, default=500) # Changed to BigInteger
-    happiness = db.Column(db.Integer, default=75)
-    karma = db.Column(db.Integer, default=0)
-    iq = db.Column(db.Integer, default=100)
-
-class Perk(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
-
-class Choice(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
-    description = db.Column(db.String(255), nullable=False)
-
-class Achievement(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
-    description = db.Column(db.String(255), nullable=False)
+import uuid
+import time
+import traceback
+import click
+from sqlalchemy import func
+from functools import wraps
+from flask import Flask, Blueprint, Response, current_app, render_template, request, redirect, url_for, flash, jsonify, abort, session, make_response, stream_with_context
+from flask_login import LoginManager, login_user, logout_user, current_user, login_required
+from config import CONFIGS
+
+from models import db, User, Character, LifeEvent, Choice, TurnJob, touch_user
+from turn_jobs import TurnQueue, TurnError
+from assets import Assets
+from metrics import metrics
+from analytics import PopulationAnalytics
+from archive import ArchiveSweeper, archive_finished_lives, archived_timeline_page, life_details
+from database import engine_settings, upgrade_database, query_report, table_sizes
+from timeline import TIMELINE_INITIAL_EVENTS, timeline_page
+from leaderboard import AGE_BRACKETS, TIME_WINDOWS, record_death, rebuild_leaderboard, leaderboard_page, user_best_rank
+import game
+from game import ALL_PERKS, valid_perks, new_character, generate_initial_life_story, advance_character_year, speculate_next_turn
+
+# --- Extensions ---
+# Bound to an app by create_app(); importing this module builds nothing, so scripts that only need the game or
+# the models don't pay for an app, and heavy client libraries (Gemini, NumPy) load on first use.
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+turn_queue = TurnQueue()
+assets = Assets()
+analytics = PopulationAnalytics()
+archive_sweeper = ArchiveSweeper()
+metrics.gauge('turn_stream_listeners', "Open /turns/<id>/events connections.", lambda: turn_queue.listeners)
+metrics.gauge('llm_calls_in_flight', "Model calls currently holding an API key.", lambda: game.services().backend.stats().get('in_flight', 0) if game.services().backend else 0)
+bp = Blueprint('main', __name__, cli_group=None)
+
+# --- App Factory ---
+def create_app(config=None):
+    # config is a name from config.CONFIGS or a config class; by default APP_ENV picks it ('production' if unset).
+    # `flask` finds this on its own; run a server with e.g. gunicorn 'app:create_app()'.
+    if config is None: config = os.getenv("APP_ENV", "production")
+    if isinstance(config, str): config = CONFIGS[config]
+    app = Flask(__name__)
+    app.config.from_object(config)
+    game.init_app(app)
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_settings(app.config['DATABASE_URL'])
+    db.init_app(app)
+    login_manager.init_app(app)
+    turn_queue.init_app(app)
+    assets.init_app(app)
+    metrics.init_app(app)
+    analytics.init_app(app)
+    archive_sweeper.init_app(app)
+    app.register_blueprint(bp)
+    return app
 
 @login_manager.user_loader
 def load_user(user_id): return User.query.get(int(user_id))
 
-def call_gemini_api(prompt_data):
-    global api_key_index
-    if not all(GEMINI_API_KEYS) or GEMINI_API_KEYS == ['']: return None
-    try:
-        api_key = GEMINI_API_KEYS[api_key_index % len(GEMINI_API_KEYS)]
-        api_key_index += 1
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt_text = json.dumps(prompt_data)
-        generation_config = genai.types.GenerationConfig(response_mime_type="application/json")
-        response = model.generate_content(prompt_text, generation_config=generation_config)
-        return json.loads(response.text)
-    except (Exception, json.JSONDecodeError) as e:
-        print(f"An error occurred with the Gemini API or parsing its response: {e}")
-        return None
-
-def get_full_history(character):
-    return [{"year": e.year, "summary": e.summary} for e in character.events]
-
-def generate_initial_life_story(character):
-    prompt1_data = {
-        "task": "generate_initial_narrative",
-        "instruction": "You are a life simulator AI. Create a narrative for the first 5 years of a character's life. The character is an infant and toddler during this period. Events MUST be appropriate for this age range (e.g., learning to walk, first words, playing with toys). Perks should manifest in subtle, nascent ways (e.g., a 'Genius' baby might be fascinated by patterns, not solving calculus).",
-        "character_details": { "name": character.name, "gender": character.gender, "perks": [p.name for p in character.perks] },
-        "response_schema": { "1": "Summary for year 1.", "2": "...", "3": "...", "4": "...", "5": "..." }
-    }
-    narrative_json = call_gemini_api(prompt1_data)
-    if not narrative_json: return False, "Failed to generate life story."
-    try:
-        full_summary = "\n".join(narrative_json.values())
-        for year, summary in narrative_json.items():
-            db.session.add(LifeEvent(character_id=character.id, year=int(year), summary=summary))
-        character.age = 5
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if current_user.username not in current_app.config['ADMIN_USERNAMES']: abort(404)
+        return view(*args, **kwargs)
+    return wrapped
+
+# --- Turn Jobs ---
+@turn_queue.handler('create')
+@metrics.turn('create')
+def run_create_job(job, payload):
+    character = Character.query.get(job.character_id)
+    if character is None: return None
+    success, message = generate_initial_life_story(character, hold=lambda: turn_queue.hold(job), final_attempt=job.attempts >= turn_queue.max_attempts)
+    if success:
+        game.services().speculator.schedule(run_speculation, character.id)
+        return 'success', f'Your new life as {character.name} has begun!'
+    # Nothing of the story was written, so a retry starts from birth again; after the last attempt the character goes too.
+    db.session.rollback()
+    if job.attempts >= turn_queue.max_attempts:
+        touch_user(character.user_id)
+        db.session.delete(character)
+        turn_queue.hold(job)
         db.session.commit()
-    except (TypeError, KeyError, AttributeError) as e: return False, f"Received an invalid narrative format from the AI: {e}"
-    
-    prompt2_data = {
-        "task": "evaluate_attributes_and_score",
-        "narrative": full_summary,
-        "response_schema": {
-            "health": "Integer 0-100", "wealth": "Integer, can be very large (e.g., 500, 10000, 1000000)",
-            "happiness": "Integer 0-100", "karma": "Integer -100 to 100",
-            "iq": "Integer 0-300", "life_score": "An integer score from 0-200 for this 5-year period."
-        }
-    }
-    attributes_json = call_gemini_api(prompt2_data)
-    if not attributes_json: return False, "Failed to evaluate attributes."
-    try:
-        character.score += int(attributes_json.get('life_score', 0))
-        new_attributes = Attribute(
-            character_id=character.id, year=character.age,
-            health=int(attributes_json.get('health', 100)),
-            wealth=int(attributes_json.get('wealth', 500)),
-            happiness=int(attributes_json.get('happiness', 75)),
-            karma=int(attributes_json.get('karma', 0)),
-            iq=int(attributes_json.get('iq', 100))
-        )
-        db.session.add(new_attributes)
-        db.session.commit()
-    except (TypeError, KeyError, ValueError): return False, "Received an invalid attribute format from the AI."
-    
-    if not generate_turn_results(character, new_attributes, get_full_history(character)):
-        return False, "Failed to generate initial choices and achievements."
-    return True, "Success"
-
-def generate_turn_results(character, latest_attributes, full_history):
-    prompt3_data = {
-        "task": "generate_turn_results",
-        "instruction": "You are a life simulator AI. All generated choices and achievements MUST be realistic and appropriate for the character's specific age.",
-        "character_details": { "name": character.name, "age": character.age, "attributes": { "health": latest_attributes.health, "wealth": latest_attributes.wealth, "happiness": latest_attributes.happiness, "karma": latest_attributes.karma, "iq": latest_attributes.iq } },
-        "life_history": full_history,
-        "response_schema": { "choices": ["List of 10 string choices"], "achievements": ["List of string achievements"] }
-    }
-    results_json = call_gemini_api(prompt3_data)
-    if not results_json: return False
-    try:
-        Choice.query.filter_by(character_id=character.id).delete()
-        for choice_desc in results_json.get("choices", []):
-            db.session.add(Choice(character_id=character.id, description=choice_desc))
-        Achievement.query.filter_by(character_id=character.id).delete()
-        for achievement_desc in results_json.get("achievements", []):
-            db.session.add(Achievement(character_id=character.id, description=achievement_desc))
-        db.session.commit()
-        return True
-    except (TypeError, KeyError): return False
-
-@app.route('/')
-def index(): return redirect(url_for('login'))
-
-@app.route('/login', methods=['GET', 'POST'])
+    raise TurnError(message)
+
+@turn_queue.handler('advance')
+@metrics.turn('advance')
+def run_advance_job(job, payload):
+    character = Character.query.get(job.character_id)
+    if character is None or not character.is_alive: return None
+    saved_before = character.memory.tokens_saved if character.memory else 0
+    speculator = game.services().speculator
+    if speculator.enabled and job.attempts == 1:
+        speculator.observe([c.description for c in Choice.query.filter_by(character_id=character.id).order_by(Choice.id)], payload.get('choices', []))
+    turn_stats, started = {}, time.perf_counter()
+    publish = lambda event, data: turn_queue.publish(job.id, event, data)
+    result = advance_character_year(character, payload.get('choices', []), turn_stats, publish, hold=lambda: turn_queue.hold(job), final_attempt=job.attempts >= turn_queue.max_attempts)
+    if character.is_alive: speculator.schedule(run_speculation, character.id)
+    job.duration_ms = int((time.perf_counter() - started) * 1000)
+    job.turn_mode, job.fallbacks = turn_stats['mode'], ','.join(turn_stats['fallbacks'])
+    job.tokens_saved = (character.memory.tokens_saved if character.memory else 0) - saved_before
+    return result
+
+def run_speculation(character_id):
+    with turn_queue.app.app_context():
+        try:
+            character = db.session.get(Character, character_id)
+            if character: speculate_next_turn(character)
+        except Exception:
+            traceback.print_exc()
+
+# --- Conditional GETs ---
+# Pages carry an ETag built from the version counters their content depends on, so a revisit with nothing new
+# gets a 304 before any template is rendered. A waiting flash message always forces a render.
+def not_modified(etag):
+    if '_flashes' in session or not request.if_none_match.contains(etag): return None
+    return versioned(current_app.response_class(status=304), etag)
+
+def versioned(response, etag):
+    response = make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def turn_job_status(job):
+    status = {'id': job.id, 'state': job.state, 'redirect': None}
+    if job.state in ('done', 'failed'):
+        if not job.notified:
+            if job.message: flash(job.message, job.category)
+            job.notified = True; db.session.commit()
+        character_exists = Character.query.get(job.character_id) is not None
+        status['redirect'] = url_for('main.life_view', character_id=job.character_id) if character_exists else url_for('main.create_character')
+    return status
+
+@bp.route('/')
+def index(): return redirect(url_for('main.login'))
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
-    if current_user.is_authenticated: return redirect(url_for('dashboard'))
+    if current_user.is_authenticated: return redirect(url_for('main.dashboard'))
     if request.method == 'POST':
         user = User.query.filter_by(username=request.form.get('username')).first()
         if user and user.check_password(request.form.get('password')):
-            login_user(user); return redirect(url_for('dashboard'))
+            login_user(user); return redirect(url_for('main.dashboard'))
         flash('Invalid username or password.', 'danger')
     return render_template('login.html')
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
-    if current_user.is_authenticated: return redirect(url_for('dashboard'))
+    if current_user.is_authenticated: return redirect(url_for('main.dashboard'))
     if request.method == 'POST':
         if User.query.filter_by(username=request.form.get('username')).first():
-            flash('Username already exists.', 'warning'); return redirect(url_for('signup'))
+            flash('Username already exists.', 'warning'); return redirect(url_for('main.signup'))
         new_user = User(username=request.form.get('username'))
         new_user.set_password(request.form.get('password'))
         db.session.add(new_user); db.session.commit()
-        flash('Account created! Please log in.', 'success'); return redirect(url_for('login'))
+        flash('Account created! Please log in.', 'success'); return redirect(url_for('main.login'))
     return render_template('signup.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
-def logout(): logout_user(); return redirect(url_for('login'))
+def logout(): logout_user(); return redirect(url_for('main.login'))
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
+    etag = f"dashboard-{current_user.id}-{current_user.version}-{assets.version}"
+    cached = not_modified(etag)
+    if cached: return cached
     active_characters = Character.query.filter_by(user_id=current_user.id, is_alive=True).order_by(Character.id.desc()).all()
     completed_characters = Character.query.filter_by(user_id=current_user.id, is_alive=False).order_by(Character.id.desc()).all()
-    return render_template('dashboard.html', active_characters=active_characters, completed_characters=completed_characters)
+    return versioned(render_template('dashboard.html', active_characters=active_characters, completed_characters=completed_characters), etag)
 
-@app.route('/leaderboard')
+@bp.route('/leaderboard')
 @login_required
 def leaderboard():
-    dead_characters = Character.query.filter_by(is_alive=False).order_by(Character.score.desc()).all()
-    leaderboard_data = []
-    for char in dead_characters:
-        player = User.query.get(char.user_id)
-        leaderboard_data.append({
-            'player_name': player.username if player else "Unknown",
-            'character_name': char.name, 'age': char.age, 'score': char.score
-        })
-    return render_template('leaderboard.html', leaderboard=leaderboard_data)
-
-@app.route('/create-character', methods=['GET', 'POST'])
+    age_bracket = request.args.get('age') if request.args.get('age') in AGE_BRACKETS else None
+    window = request.args.get('window') if request.args.get('window') in TIME_WINDOWS else None
+    leaderboard_data, next_cursor = leaderboard_page(request.args.get('after'), age_bracket, window)
+    return render_template(
+        'leaderboard.html', leaderboard=leaderboard_data, next_cursor=next_cursor, first_page=not request.args.get('after'),
+        my_rank=user_best_rank(current_user.id, age_bracket, window), age_bracket=age_bracket, window=window,
+        age_brackets=AGE_BRACKETS, time_windows=TIME_WINDOWS
+    )
+
+@bp.route('/create-character', methods=['GET', 'POST'])
 @login_required
 def create_character():
     if request.method == 'POST':
-        new_char = Character(user_id=current_user.id, name=request.form.get('name'), gender=request.form.get('gender'))
-        db.session.add(new_char); db.session.flush()
-        for perk_name in request.form.getlist('perks'):
-            db.session.add(Perk(character_id=new_char.id, name=perk_name))
-        db.session.commit()
-        success, message = generate_initial_life_story(new_char)
-        if success:
-            flash(f'Your new life as {new_char.name} has begun!', 'success')
-            return redirect(url_for('life_view', character_id=new_char.id))
-        else:
-            flash(message, 'danger'); db.session.delete(new_char); db.session.commit()
-            return redirect(url_for('create_character'))
-    return render_template('create_character.html', perks=random.sample(ALL_PERKS, 6))
-
-@app.route('/life/<int:character_id>')
+        create_key = request.form.get('create_key') or uuid.uuid4().hex
+        existing = TurnJob.query.filter_by(idempotency_key=f"create:{create_key}").first()
+        # A failed create job has deleted its character; resubmitting the form starts over (enqueue releases the key).
+        if existing and existing.state != 'failed': return redirect(url_for('main.life_view', character_id=existing.character_id))
+        perk_names = request.form.getlist('perks')
+        if not valid_perks(perk_names):
+            flash('Choose three different perks from the ones offered.', 'warning'); return redirect(url_for('main.create_character'))
+        new_char = new_character(current_user.id, request.form.get('name'), request.form.get('gender'), perk_names)
+        turn_queue.enqueue('create', current_user.id, new_char.id, f"create:{create_key}")
+        return redirect(url_for('main.life_view', character_id=new_char.id))
+    return render_template('create_character.html', perks=random.sample(ALL_PERKS, 6), create_key=uuid.uuid4().hex)
+
+@bp.route('/life/<int:character_id>')
 @login_required
 def life_view(character_id):
     character = Character.query.get_or_404(character_id)
-    if character.user_id != current_user.id: return redirect(url_for('dashboard'))
-    latest_attributes = Attribute.query.filter_by(character_id=character.id).order_by(Attribute.year.desc()).first()
-    choices = Choice.query.filter_by(character_id=character.id).all()
-    achievements = Achievement.query.filter_by(character_id=character.id).all()
-    return render_template('life_view.html', character=character, attributes=latest_attributes, choices=[c.description for c in choices], achievements=achievements)
+    if character.user_id != current_user.id: return redirect(url_for('main.dashboard'))
+    pending_job = turn_queue.active_job(character.id)
+    for job in TurnJob.query.filter_by(character_id=character.id, notified=False).filter(TurnJob.state.in_(('done', 'failed'))):
+        turn_job_status(job)
+    etag = f"life-{character.id}-{character.version}-{pending_job.id if pending_job else 0}-{assets.version}"
+    cached = not_modified(etag)
+    if cached: return cached
+    latest_attributes, perks, choices, achievements = life_details(character)
+    # Only the latest years are rendered; the timeline endpoint pages in older ones as the log is scrolled.
+    events, next_cursor = (archived_timeline_page if character.archived else timeline_page)(character.id, page_size=TIMELINE_INITIAL_EVENTS)
+    return versioned(render_template('life_view.html', character=character, attributes=latest_attributes, perks=perks, choices=choices, achievements=achievements, pending_job=pending_job, events=events, next_cursor=next_cursor), etag)
+
+@bp.route('/life/<int:character_id>/timeline')
+@login_required
+def life_timeline(character_id):
+    character = Character.query.get_or_404(character_id)
+    if character.user_id != current_user.id: abort(404)
+    events, next_cursor = (archived_timeline_page if character.archived else timeline_page)(character.id, request.args.get('after'), request.args.get('limit', type=int))
+    return jsonify({'events': events, 'next_cursor': next_cursor})
 
-@app.route('/life/<int:character_id>/end', methods=['POST'])
+@bp.route('/turns/<int:job_id>')
+@login_required
+def turn_status(job_id):
+    job = TurnJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id: abort(404)
+    return jsonify(turn_job_status(job))
+
+@bp.route('/turns/<int:job_id>/events')
+@login_required
+def turn_events(job_id):
+    # Server-Sent Events for a running turn: the year's story as the model writes it, then its attributes and
+    # choices, then 'done', after which the page fetches turn_status for the redirect and flash message.
+    job = TurnJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id: abort(404)
+    if turn_queue.listeners >= current_app.config['TURN_STREAM_MAX_LISTENERS']: abort(503)
+    db.session.remove() # the stream can stay open for a while; don't hold a pooled connection for it
+
+    def event_stream():
+        for event, data in turn_queue.listen(job_id):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n" if event else ": keep-alive\n\n"
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/life/<int:character_id>/end', methods=['POST'])
 @login_required
 def end_life(character_id):
     character = Character.query.get_or_404(character_id)
     if character.user_id != current_user.id or not character.is_alive:
-        return redirect(url_for('dashboard'))
-    
+        return redirect(url_for('main.dashboard'))
+    if turn_queue.active_job(character.id):
+        flash("Wait for the current year to finish before ending this life.", "warning")
+        return redirect(url_for('main.life_view', character_id=character.id))
+
     character.is_alive = False
+    record_death(character)
     db.session.add(LifeEvent(character_id=character.id, year=character.age, summary=f"{character.name} decided to end their story peacefully at the age of {character.age}."))
+    character.touch()
     db.session.commit()
     flash(f"{character.name}'s story has concluded by your choice.", "info")
-    return redirect(url_for('life_view', character_id=character.id))
+    return redirect(url_for('main.life_view', character_id=character.id))
 
-@app.route('/life/<int:character_id>/advance', methods=['POST'])
+@bp.route('/life/<int:character_id>/advance', methods=['POST'])
 @login_required
 def advance_year(character_id):
     character = Character.query.get_or_404(character_id)
-    if character.user_id != current_user.id or not character.is_alive: return redirect(url_for('dashboard'))
-
-    # --- START OF MODIFICATION ---
-    # Increment age at the beginning of the turn
-    character.age += 1
-    db.session.commit()
-
-    # Check for death by old age if character is 60 or older
-    if character.age >= 60:
-        # The probability of death increases by 2.5% for each year over 59.
-        # at 60, probability is 2.5%
-        # at 70, probability is 27.5%
-        # at 100, probability is 102.5% (guaranteed death)
-        death_probability = (character.age - 59) * 0.025
-        if random.random() < death_probability:
-            character.is_alive = False
-            # Add a life event for the death
-            db.session.add(LifeEvent(character_id=character.id, year=character.age, summary=f"{character.name} passed away of natural causes at the age of {character.age}."))
-            db.session.commit()
-            flash(f"{character.name} has passed away at {character.age} years old.", "info")
-            return redirect(url_for('life_view', character_id=character.id))
-    # --- END OF MODIFICATION ---
-
-    latest_attributes = Attribute.query.filter_by(character_id=character.id).order_by(Attribute.year.desc()).first()
-    
-    # Modified prompt to inform the AI about the age-based death mechanic
-    prompt1_data = {
-        "task": "advance_year_narrative",
-        "instruction": f"You are a life simulator AI. The narrative summary MUST be realistic for the character's specific age. A 6-year-old starts school, a 90-year-old retires. The character is now {character.age} years old. Note that there's an increasing chance of natural death after age 60, which is handled by the game logic.",
-        "character_details": { "name": character.name, "age": character.age, "attributes": { "health": latest_attributes.health, "wealth": latest_attributes.wealth, "happiness": latest_attributes.happiness, "karma": latest_attributes.karma, "iq": latest_attributes.iq } },
-        "life_history": get_full_history(character),
-        "player_choices": request.form.getlist('choices'),
-        "response_schema": { "summary": "A 5-8 sentence summary for the next year.", "is_deceased": "A boolean (true/false) indicating if the character died this year from events in the narrative (not old age)." }
-    }
-
-    narrative_json = call_gemini_api(prompt1_data)
-    if not narrative_json:
-        flash("The story could not continue. Please try again.", "danger")
-        character.age -=1 # Revert age increment on failure
-        db.session.commit()
-        return redirect(url_for('life_view', character_id=character_id))
-
-    try:
-        next_year_summary = narrative_json['summary']
-        is_deceased_from_event = narrative_json.get('is_deceased', False)
-
-        db.session.add(LifeEvent(character_id=character.id, year=character.age, summary=next_year_summary))
-        db.session.commit()
-
-        if is_deceased_from_event:
-            character.is_alive = False
-            if latest_attributes:
-                latest_attributes.health = 0
-            db.session.commit()
-            flash(f"{character.name} has passed away at the age of {character.age}.", "info")
-            return redirect(url_for('life_view', character_id=character.id))
-    except KeyError:
-        flash("Received an invalid story format from the AI.", "danger")
-        character.age -=1 # Revert age increment on failure
-        db.session.commit()
-        return redirect(url_for('life_view', character_id=character_id))
-    
-    prompt2_data = {
-        "task": "evaluate_attributes_and_score", "narrative": next_year_summary,
-        "previous_attributes": { "health": latest_attributes.health, "wealth": latest_attributes.wealth, "happiness": latest_attributes.happiness, "karma": latest_attributes.karma, "iq": latest_attributes.iq },
-        "response_schema": {
-            "health": "Integer 0-100", "wealth": "Integer, can be very large",
-            "happiness": "Integer 0-100", "karma": "Integer -100 to 100",
-            "iq": "Integer 0-300", "life_score": "Integer 0-200"
+    if character.user_id != current_user.id or not character.is_alive: return redirect(url_for('main.dashboard'))
+    # The form carries the age it was rendered at, so a double-submit maps onto the same job instead of aging twice.
+    turn_key = request.form.get('turn_key') or character.age
+    turn_queue.enqueue('advance', current_user.id, character.id, f"advance:{character.id}:{turn_key}", {'choices': request.form.getlist('choices')})
+    return redirect(url_for('main.life_view', character_id=character.id))
+
+@bp.route('/admin/llm-pool')
+@admin_required
+def llm_pool_stats(): return jsonify(dict(game.services().backend.stats(), latency_budget=game.services().budget.stats()))
+
+@bp.route('/admin/speculation')
+@admin_required
+def speculation_stats(): return jsonify(game.services().speculator.stats())
+
+@bp.route('/admin/llm-spans')
+@admin_required
+def llm_spans(): return jsonify(metrics.recent_spans())
+
+@bp.route('/admin/llm-cache')
+@admin_required
+def llm_cache_stats(): return jsonify(game.services().cache.stats())
+
+@bp.route('/admin/llm-cache/purge', methods=['POST'])
+@admin_required
+def purge_llm_cache():
+    purged = game.services().cache.purge(task=request.form.get('task'), expired_only=request.form.get('expired_only') == '1')
+    return jsonify({'purged': purged})
+
+@bp.route('/admin/stats')
+@admin_required
+def population_stats(): return jsonify(analytics.report())
+
+@bp.route('/admin/turn-latency')
+@admin_required
+def turn_latency_stats():
+    # Counts and means over every finished turn, in SQL; percentiles over the most recent TURN_LATENCY_SAMPLE of them.
+    report = {}
+    finished = TurnJob.query.filter(TurnJob.kind == 'advance', TurnJob.state == 'done', TurnJob.turn_mode.isnot(None), TurnJob.duration_ms.isnot(None))
+    totals = finished.with_entities(TurnJob.turn_mode, func.count(), func.avg(TurnJob.duration_ms), func.count(func.nullif(TurnJob.fallbacks, ''))).group_by(TurnJob.turn_mode)
+    for mode, turns, mean_ms, with_fallbacks in totals:
+        recent = [d for d, in finished.filter(TurnJob.turn_mode == mode).with_entities(TurnJob.duration_ms).order_by(TurnJob.id.desc()).limit(current_app.config['TURN_LATENCY_SAMPLE'])]
+        durations = sorted(recent)
+        report[mode] = {
+            'turns': turns, 'mean_ms': int(mean_ms), 'sampled': len(durations),
+            'p50_ms': durations[len(durations) // 2], 'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            'turns_with_fallbacks': with_fallbacks
         }
-    }
-    attributes_json = call_gemini_api(prompt2_data)
-    new_attributes = latest_attributes
-    if attributes_json:
-        try:
-            character.score += int(attributes_json.get('life_score', 0))
-            new_attributes = Attribute(
-                character_id=character.id, year=character.age,
-                health=int(attributes_json.get('health', latest_attributes.health)),
-                wealth=int(attributes_json.get('wealth', latest_attributes.wealth)),
-                happiness=int(attributes_json.get('happiness', latest_attributes.happiness)),
-                karma=int(attributes_json.get('karma', latest_attributes.karma)),
-                iq=int(attributes_json.get('iq', latest_attributes.iq))
-            )
-            db.session.add(new_attributes); db.session.commit()
-            if new_attributes.health <= 0:
-                character.is_alive = False
-                db.session.add(LifeEvent(character_id=character.id, year=character.age, summary=f"{character.name}'s journey has come to an end due to poor health."))
-                db.session.commit()
-                flash(f"{character.name} has passed away at the age of {character.age}.", "info")
-                return redirect(url_for('life_view', character_id=character.id))
-        except (TypeError, KeyError, ValueError): pass
-    
-    generate_turn_results(character, new_attributes, get_full_history(character))
-    return redirect(url_for('life_view', character_id=character.id))
+    return jsonify(report)
+
+@bp.route('/metrics')
+def metrics_export():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}": abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    applied = upgrade_database()
+    print(f"Applied migrations: {', '.join(applied)}" if applied else "Database schema is up to date.")
+
+@bp.cli.command('db-report')
+def db_report_command():
+    for row in query_report():
+        print(f"{row['query']:<20} {row['avg_ms']:>8.3f} ms  {'index' if row['uses_index'] else 'FULL SCAN':<9}  {' | '.join(row['plan'])}")
+    for table, size in table_sizes():
+        print(f"{table:<20} {size / 1024:>10.1f} KB")
+
+@bp.cli.command('rebuild-leaderboard')
+def rebuild_leaderboard_command():
+    print(f"Leaderboard rebuilt with {rebuild_leaderboard()} finished lives.")
+
+@bp.cli.command('archive-lives')
+@click.option('--all', 'everything', is_flag=True, help="Also archive lives that ended within ARCHIVE_AFTER_SECONDS.")
+def archive_lives_command(everything):
+    totals = [0, 0, 0]
+    while True:
+        batch = archive_finished_lives(older_than=0 if everything else archive_sweeper.older_than)
+        totals = [t + b for t, b in zip(totals, batch)]
+        if batch[0] == 0: break
+    lives, raw_bytes, stored_bytes = totals
+    print(f"Archived {lives} finished lives: {raw_bytes / 1024:.1f} KB of rows stored as {stored_bytes / 1024:.1f} KB." if lives else "No finished lives are due for archiving.")
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    written = assets.build()
+    print(f"Wrote {len(written)} compressed asset variants to static/dist." if written else "Compressed assets are up to date.")
 
 if __name__ == '__main__':
+    app = create_app('development')
     with app.app_context():
-        db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+        upgrade_database()
+    app.run()
\ No newline at end of file
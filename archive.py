@@ -0,0 +1,159 @@
+import os
+import json
+import zlib
+import time
+import threading
+import traceback
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from sqlalchemy import select, delete, or_
+from sqlalchemy.exc import IntegrityError
+from models import db, Character, LifeEvent, Attribute, Perk, Choice, Achievement, LifeMemory, LeaderboardEntry, ArchivedLife
+from timeline import TIMELINE_PAGE_SIZE, TIMELINE_MAX_PAGE_SIZE, parse_cursor
+
+try:
+    import zstandard
+except ImportError: # optional; without it archives are zlib-compressed
+    zstandard = None
+
+ARCHIVE_AFTER_SECONDS = float(os.getenv("ARCHIVE_AFTER_SECONDS", 600))
+ARCHIVE_SWEEP_SECONDS = float(os.getenv("ARCHIVE_SWEEP_SECONDS", 300))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 200))
+ARCHIVE_CACHE_ENTRIES = 256
+ATTRIBUTE_COLUMNS = ('id', 'year', 'health', 'wealth', 'happiness', 'karma', 'iq')
+
+# Archives never change, so decoded ones are kept for repeat views and timeline scrolls.
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+
+def compress(raw):
+    if zstandard: return 'zstd', zstandard.ZstdCompressor(level=19).compress(raw)
+    return 'zlib', zlib.compress(raw, 9)
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None: raise RuntimeError("This life was archived with zstd; install zstandard to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+# --- Packing ---
+def archive_life(character):
+    # Packs a dead character's row-per-year data into one ArchivedLife and deletes those rows, in one commit.
+    # The Character and its LeaderboardEntry stay, so pages that list lives don't notice. Returns the ArchivedLife.
+    character_id = character.id
+    events = db.session.execute(select(LifeEvent.id, LifeEvent.year, LifeEvent.summary).where(LifeEvent.character_id == character_id)
+                                .order_by(LifeEvent.year.desc(), LifeEvent.id.desc())).all()
+    attributes = db.session.execute(select(*(getattr(Attribute, name) for name in ATTRIBUTE_COLUMNS)).where(Attribute.character_id == character_id)
+                                    .order_by(Attribute.year, Attribute.id)).all()
+    record = {
+        'events': [list(row) for row in events], # newest first, the order the timeline pages in
+        'attributes': {name: [row[i] for row in attributes] for i, name in enumerate(ATTRIBUTE_COLUMNS)}, # columns compress better than rows
+        'perks': db.session.execute(select(Perk.name).where(Perk.character_id == character_id).order_by(Perk.id)).scalars().all(),
+        'choices': db.session.execute(select(Choice.description).where(Choice.character_id == character_id).order_by(Choice.id)).scalars().all(),
+        'achievements': db.session.execute(select(Achievement.description).where(Achievement.character_id == character_id).order_by(Achievement.id)).scalars().all()
+    }
+    raw = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    codec, data = compress(raw)
+    archived = ArchivedLife(character_id=character_id, codec=codec, data=data, raw_bytes=len(raw))
+    db.session.add(archived)
+    for model in (LifeEvent, Attribute, Perk, Choice, Achievement, LifeMemory):
+        db.session.execute(delete(model).where(model.character_id == character_id))
+    character.archived = True
+    db.session.commit()
+    return archived
+
+def archive_finished_lives(older_than=ARCHIVE_AFTER_SECONDS, limit=ARCHIVE_BATCH):
+    # Archives up to limit lives that ended more than older_than seconds ago. Returns (lives, raw bytes, stored bytes).
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+    due = (db.session.query(Character).join(LeaderboardEntry, LeaderboardEntry.character_id == Character.id)
+           .filter(Character.is_alive == False, Character.archived == False, or_(LeaderboardEntry.died_at <= cutoff, LeaderboardEntry.died_at.is_(None)))
+           .order_by(Character.id).limit(limit).all())
+    lives, raw_bytes, stored_bytes = 0, 0, 0
+    for character in due:
+        try:
+            archived = archive_life(character)
+        except IntegrityError:
+            # Another process archived it first.
+            db.session.rollback()
+            continue
+        lives += 1; raw_bytes += archived.raw_bytes; stored_bytes += len(archived.data)
+    return lives, raw_bytes, stored_bytes
+
+
+# --- Reading ---
+def load_archive(character_id):
+    with _decoded_lock:
+        if character_id in _decoded:
+            _decoded.move_to_end(character_id)
+            return _decoded[character_id]
+    archived = ArchivedLife.query.filter_by(character_id=character_id).first()
+    if archived is None: return None
+    record = json.loads(decompress(archived.codec, archived.data))
+    with _decoded_lock:
+        _decoded[character_id] = record
+        while len(_decoded) > ARCHIVE_CACHE_ENTRIES: _decoded.popitem(last=False)
+    return record
+
+def life_details(character):
+    # What life_view shows beside the timeline, from the hot tables or the archive: the latest attributes
+    # (an object or dict with health, wealth, ...; None before the first year) and lists of perk names,
+    # choice and achievement descriptions.
+    if character.archived:
+        record = load_archive(character.id)
+        columns = record['attributes']
+        latest = {name: values[-1] for name, values in columns.items()} if columns['year'] else None
+        return latest, record['perks'], record['choices'], record['achievements']
+    latest = Attribute.query.filter_by(character_id=character.id).order_by(Attribute.year.desc()).first()
+    return (latest, [p.name for p in character.perks],
+            [c.description for c in Choice.query.filter_by(character_id=character.id).all()],
+            [a.description for a in Achievement.query.filter_by(character_id=character.id).all()])
+
+def archived_timeline_page(character_id, cursor=None, page_size=None):
+    # timeline_page() over an archived life's events, with the same (year desc, id desc) order and cursors.
+    page_size = max(1, min(page_size or TIMELINE_PAGE_SIZE, TIMELINE_MAX_PAGE_SIZE))
+    events = load_archive(character_id)['events']
+    after = parse_cursor(cursor)
+    if after: events = [e for e in events if (e[1], e[0]) < after]
+    rows = [{'id': e[0], 'year': e[1], 'summary': e[2]} for e in events[:page_size]]
+    next_cursor = f"{rows[-1]['year']}:{rows[-1]['id']}" if len(events) > page_size else None
+    return rows, next_cursor
+
+
+class ArchiveSweeper:
+    # Background thread that archives finished lives every ARCHIVE_SWEEP_SECONDS (0 turns it off; the
+    # archive-lives command does the same by hand). It starts with the first request, not at import, so
+    # CLI commands such as upgrade-db don't race it.
+    def __init__(self, app=None, interval=ARCHIVE_SWEEP_SECONDS, older_than=ARCHIVE_AFTER_SECONDS):
+        self.interval = interval
+        self.older_than = older_than
+        self.thread = None
+        self.totals = {'sweeps': 0, 'lives': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        self._lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if self.interval > 0: app.before_request(self._start)
+        app.extensions['archive_sweeper'] = self
+
+    def _start(self):
+        if self.thread is not None: return
+        with self._lock:
+            if self.thread is not None: return
+            self.thread = threading.Thread(target=self._run, name='archive-sweeper', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    while True:
+                        lives, raw_bytes, stored_bytes = archive_finished_lives(self.older_than)
+                        self.totals['lives'] += lives; self.totals['raw_bytes'] += raw_bytes; self.totals['stored_bytes'] += stored_bytes
+                        if lives < ARCHIVE_BATCH: break
+                    self.totals['sweeps'] += 1
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,81 @@
+import os
+import gzip
+import json
+import hashlib
+from flask import abort, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError: # optional; without it only gzip variants are built
+    brotli = None
+
+ASSET_DIRS = ('css', 'js')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+
+class Assets:
+    # Serves static CSS/JS under content-fingerprinted names (css/life_view.3f2a9c1be04d.css), so pages can
+    # tell browsers to keep them for a year: any edit changes the name. `flask build-assets` writes gzip and
+    # brotli variants into static/dist, which are sent as-is to browsers that accept them.
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.sources = {}
+        self.version = None
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.dist_folder = os.path.join(app.static_folder, 'dist')
+        self.scan()
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.extensions['assets'] = self
+
+    def scan(self):
+        manifest, sources = {}, {}
+        for folder in ASSET_DIRS:
+            root = os.path.join(self.static_folder, folder)
+            if not os.path.isdir(root): continue
+            for name in sorted(os.listdir(root)):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f: digest = hashlib.sha256(f.read()).hexdigest()[:12]
+                stem, ext = os.path.splitext(name)
+                fingerprinted = f"{folder}/{stem}.{digest}{ext}"
+                manifest[f"{folder}/{name}"], sources[fingerprinted] = fingerprinted, path
+        self.manifest, self.sources = manifest, sources
+        # Changes whenever any asset does; page ETags include it so a deploy invalidates them.
+        self.version = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def url(self, name):
+        return url_for('asset', filename=self.manifest[name])
+
+    def build(self):
+        # Writes <fingerprinted>.gz (and .br when brotli is installed) for every asset; returns the paths written.
+        written = []
+        for fingerprinted, source in self.sources.items():
+            with open(source, 'rb') as f: data = f.read()
+            variants = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+            if brotli: variants.append(('.br', lambda d: brotli.compress(d, quality=11)))
+            for suffix, compress in variants:
+                target = os.path.join(self.dist_folder, fingerprinted + suffix)
+                if os.path.exists(target): continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f: f.write(compress(data))
+                written.append(target)
+        return written
+
+    def serve(self, filename):
+        source = self.sources.get(filename)
+        if source is None: abort(404)
+        mimetype = 'text/css' if filename.endswith('.css') else 'application/javascript'
+        path, encoding = source, None
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            variant = os.path.join(self.dist_folder, filename + suffix)
+            if name in request.accept_encodings and os.path.exists(variant):
+                path, encoding = variant, name
+                break
+        response = send_file(path, mimetype=mimetype, conditional=True, max_age=ASSET_MAX_AGE)
+        if encoding: response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,66 @@
+import os
+from dotenv import load_dotenv
+from llm_cache import parse_task_ttls
+
+# Load environment variables from .env file, before any module reads its settings from the environment
+load_dotenv()
+
+
+class Config:
+    # Production settings, which the other environments start from. APP_ENV picks one (see CONFIGS).
+    SECRET_KEY = os.getenv("SECRET_KEY", 'a-super-secret-key-that-is-hard-to-guess')
+    # DATABASE_URL points the app at another database, e.g. Postgres; the default stays the bundled SQLite file.
+    DATABASE_URL = os.getenv("DATABASE_URL", 'sqlite:///life_simulator.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    TURN_WORKERS = int(os.getenv("TURN_WORKERS", 4))
+    TURN_MAX_ATTEMPTS = int(os.getenv("TURN_MAX_ATTEMPTS", 3))
+    # Open /turns/<id>/events connections allowed per process; past it the page falls back to polling. On a threaded
+    # server each open stream holds a request thread, so keep this well below the thread count (see README)
+    TURN_STREAM_MAX_LISTENERS = int(os.getenv("TURN_STREAM_MAX_LISTENERS", 50))
+    # Share of turn job attempts run under cProfile (0 disables), and where their .prof files go (default instance/profiles)
+    TURN_PROFILE_SAMPLE_RATE = float(os.getenv("TURN_PROFILE_SAMPLE_RATE", 0))
+    TURN_PROFILE_DIR = os.getenv("TURN_PROFILE_DIR")
+    # /admin/turn-latency takes its percentiles over this many of each mode's most recent turns
+    TURN_LATENCY_SAMPLE = int(os.getenv("TURN_LATENCY_SAMPLE", 1000))
+    # When set, /metrics wants "Authorization: Bearer <token>"; otherwise keep it off the public network
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    ADMIN_USERNAMES = frozenset(name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(',') if name.strip())
+    # The model services game.init_app() builds per app; the fake backend's, Gemini pool's and speculation's tuning stays in the environment
+    # 'gemini' or the seeded offline 'fake' backend
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+    # Seconds each task may take before it is abandoned. With more than one API key, a call still waiting at its
+    # task's p95 sends a hedged duplicate to another key and takes whichever answers first.
+    LLM_TASK_BUDGETS = parse_task_ttls(os.getenv("LLM_TASK_BUDGETS", "generate_initial_narrative=40,evaluate_attributes_and_score=20,generate_turn_results=20,advance_year_narrative=30,advance_year_fused=45"))
+    LLM_DEFAULT_BUDGET = float(os.getenv("LLM_DEFAULT_BUDGET", 30))
+    LLM_HEDGING = os.getenv("LLM_HEDGING", "1") == "1"
+    LLM_MAX_HEDGE_RATIO = float(os.getenv("LLM_MAX_HEDGE_RATIO", 0.1))
+    # When a call runs out of its budget, or still fails on a job's last attempt, finish the turn with a plain
+    # template-written year instead of an error. Other failures are retried first.
+    LOCAL_NARRATOR = os.getenv("LOCAL_NARRATOR", "1") == "1"
+    # Only tasks listed here are cached, with their TTL in seconds. Attribute scoring should be repeatable;
+    # initial narratives are cached briefly so a retried character creation doesn't pay for the same prompt twice.
+    LLM_CACHE_TASKS = parse_task_ttls(os.getenv("LLM_CACHE_TASKS", "evaluate_attributes_and_score=604800,generate_initial_narrative=600"))
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'llm_cache.db')
+    LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", 1024))
+    # Off by default: each guess costs a model call, and only the one the player actually submits is used
+    SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "0") == "1"
+    # 'chained' makes three model calls per year; 'fused' asks for narrative, attributes and choices in one call
+    TURN_MODE = os.getenv("TURN_MODE", "chained")
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    # A file of its own rather than :memory:, which each turn worker thread would see as a different, empty database
+    DATABASE_URL = os.getenv("TEST_DATABASE_URL", 'sqlite:///life_simulator-test.db')
+    TURN_WORKERS = 2
+    TURN_RETRY_DELAY = 0
+    # The offline fake model and a scratch response cache, so tests never spend API quota or touch the real cache
+    LLM_BACKEND = 'fake'
+    LLM_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'llm_cache-test.db')
+    SPECULATION_ENABLED = False
+
+
+CONFIGS = {'production': Config, 'development': DevelopmentConfig, 'testing': TestingConfig}
@@ -0,0 +1,155 @@
+import os
+import time
+from datetime import datetime
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from models import db, Character, LifeEvent, Attribute, Perk, Choice, Achievement, LeaderboardEntry, TurnJob, ArchivedLife
+
+# --- Engine Configuration ---
+def engine_settings(uri):
+    # Returns (uri, SQLALCHEMY_ENGINE_OPTIONS). Server databases (e.g. postgresql+psycopg2://...) get the pool settings;
+    # SQLite gets a generous busy timeout instead, since its writers queue on a file lock rather than a pool.
+    if uri.startswith('postgres://'): uri = uri.replace('postgres://', 'postgresql://', 1)
+    if uri.startswith('sqlite'):
+        options = {'connect_args': {'timeout': float(os.getenv("SQLITE_BUSY_TIMEOUT", 30))}}
+    else:
+        options = {
+            'pool_size': int(os.getenv("DB_POOL_SIZE", 10)),
+            'max_overflow': int(os.getenv("DB_MAX_OVERFLOW", 20)),
+            'pool_timeout': float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            'pool_recycle': int(os.getenv("DB_POOL_RECYCLE", 1800)),
+            'pool_pre_ping': True
+        }
+    return uri, options
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets turn workers write while pages keep reading; synchronous=NORMAL drops the fsync on every commit
+    # (still crash-safe in WAL mode, only the last transactions can be lost on power failure).
+    if type(dbapi_connection).__module__ != 'sqlite3': return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', 20000))}")
+    cursor.close()
+
+
+# --- Schema Migrations ---
+# Applied in order, once each, and recorded in schema_migration. New steps go at the end; never edit a shipped one.
+def _create_missing_tables(conn):
+    db.metadata.create_all(conn)
+
+def _add_turn_job_columns(conn):
+    # Databases created before these TurnJob columns existed.
+    existing = {c['name'] for c in inspect(conn).get_columns('turn_job')}
+    columns = {
+        'tokens_saved': "INTEGER NOT NULL DEFAULT 0", 'turn_mode': "VARCHAR(20)",
+        'fallbacks': "VARCHAR(100)", 'duration_ms': "INTEGER"
+    }
+    for name, ddl in columns.items():
+        if name not in existing: conn.execute(text(f"ALTER TABLE turn_job ADD COLUMN {name} {ddl}"))
+
+def _add_version_columns(conn):
+    # Counters behind the life_view and dashboard ETags; "user" needs quoting on Postgres.
+    for table in ('user', 'character'):
+        if 'version' not in {c['name'] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {conn.dialect.identifier_preparer.quote(table)} ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+
+def _add_archived_lives(conn):
+    ArchivedLife.__table__.create(conn, checkfirst=True)
+    if 'archived' not in {c['name'] for c in inspect(conn).get_columns('character')}:
+        conn.execute(text(f"ALTER TABLE {conn.dialect.identifier_preparer.quote('character')} ADD COLUMN archived BOOLEAN NOT NULL DEFAULT FALSE"))
+    for index in Character.__table__.indexes:
+        if index.name == 'ix_character_alive_archived': index.create(conn, checkfirst=True)
+
+# The indexes 0003 shipped with. Indexes added to the models later get their own step, next to the columns they cover.
+HOT_PATH_INDEXES = (
+    'ix_character_alive_score', 'ix_character_user_alive', 'ix_life_event_character_year', 'ix_attribute_character_year',
+    'ix_perk_character_id', 'ix_choice_character_id', 'ix_achievement_character_id', 'ix_leaderboard_entry_score_id',
+    'ix_leaderboard_entry_user_id', 'ix_leaderboard_entry_age', 'ix_leaderboard_entry_died_at', 'ix_turn_job_character_state'
+)
+
+def _create_hot_path_indexes(conn):
+    for model in (Character, LifeEvent, Attribute, Perk, Choice, Achievement, LeaderboardEntry, TurnJob):
+        for index in model.__table__.indexes:
+            if index.name in HOT_PATH_INDEXES: index.create(conn, checkfirst=True)
+    if conn.dialect.name == 'sqlite': conn.execute(text("ANALYZE"))
+
+def _nullable_died_at(conn):
+    # Backfilled deaths with no known time store NULL. SQLite can't drop NOT NULL in place, so the table is rebuilt.
+    if next(c for c in inspect(conn).get_columns('leaderboard_entry') if c['name'] == 'died_at')['nullable']: return
+    if conn.dialect.name != 'sqlite':
+        conn.execute(text("ALTER TABLE leaderboard_entry ALTER COLUMN died_at DROP NOT NULL"))
+        return
+    for index in inspect(conn).get_indexes('leaderboard_entry'): conn.execute(text(f"DROP INDEX {index['name']}"))
+    conn.execute(text("ALTER TABLE leaderboard_entry RENAME TO leaderboard_entry_old"))
+    LeaderboardEntry.__table__.create(conn)
+    columns = ", ".join(c.name for c in LeaderboardEntry.__table__.columns)
+    conn.execute(text(f"INSERT INTO leaderboard_entry ({columns}) SELECT {columns} FROM leaderboard_entry_old"))
+    conn.execute(text("DROP TABLE leaderboard_entry_old"))
+
+MIGRATIONS = [
+    ('0001_create_missing_tables', _create_missing_tables),
+    ('0002_turn_job_columns', _add_turn_job_columns),
+    ('0003_hot_path_indexes', _create_hot_path_indexes),
+    ('0004_version_columns', _add_version_columns),
+    ('0005_archived_lives', _add_archived_lives),
+    ('0006_nullable_died_at', _nullable_died_at),
+]
+
+def upgrade_database():
+    with db.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migration (name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"))
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migration"))}
+    newly_applied = []
+    for name, step in MIGRATIONS:
+        if name in applied: continue
+        with db.engine.begin() as conn:
+            step(conn)
+            conn.execute(text("INSERT INTO schema_migration (name, applied_at) VALUES (:name, :applied_at)"), {'name': name, 'applied_at': datetime.utcnow()})
+        newly_applied.append(name)
+    return newly_applied
+
+
+# --- Query Report ---
+def hot_queries(character_id, user_id):
+    return [
+        ('latest attributes', Attribute.query.filter_by(character_id=character_id).order_by(Attribute.year.desc()).limit(1)),
+        ('choices', Choice.query.filter_by(character_id=character_id)),
+        ('achievements', Achievement.query.filter_by(character_id=character_id)),
+        ('perks', Perk.query.filter_by(character_id=character_id)),
+        ('events by year', LifeEvent.query.filter_by(character_id=character_id).order_by(LifeEvent.year.desc())),
+        ('timeline page', LifeEvent.query.filter_by(character_id=character_id).order_by(LifeEvent.year.desc(), LifeEvent.id.desc()).limit(21)),
+        ('dashboard', Character.query.filter_by(user_id=user_id, is_alive=True).order_by(Character.id.desc())),
+        ('dead by score', Character.query.filter_by(is_alive=False).order_by(Character.score.desc()).limit(50)),
+        ('leaderboard page', LeaderboardEntry.query.order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.id).limit(51)),
+        ('active turn job', TurnJob.query.filter(TurnJob.character_id == character_id, TurnJob.state.in_(('queued', 'running')))),
+    ]
+
+def table_sizes():
+    # Bytes on disk per table, its indexes included, largest first: SQLite's dbstat table or Postgres' pg_total_relation_size.
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        sql = "SELECT m.tbl_name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name GROUP BY m.tbl_name ORDER BY 2 DESC"
+    elif dialect == 'postgresql':
+        sql = "SELECT relname, pg_total_relation_size(relid) FROM pg_statio_user_tables ORDER BY 2 DESC"
+    else: return []
+    return [(name, int(size)) for name, size in db.session.execute(text(sql))]
+
+def query_report(repeat=50):
+    # Times each hot query and shows the planner's choice, so a missing index shows up as a SCAN / Seq Scan.
+    character = Character.query.order_by(Character.id.desc()).first()
+    character_id, user_id = (character.id, character.user_id) if character else (0, 0)
+    dialect = db.engine.dialect.name
+    report = []
+    for name, query in hot_queries(character_id, user_id):
+        statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        explain = "EXPLAIN QUERY PLAN " if dialect == 'sqlite' else "EXPLAIN "
+        plan = [" ".join(str(col) for col in row[-1:]) for row in db.session.execute(text(explain + str(statement)))]
+        started = time.perf_counter()
+        for _ in range(repeat): db.session.execute(text(str(statement))).fetchall()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+        full_scan = any(line.startswith('SCAN') and 'USING' not in line for line in plan) or any('Seq Scan' in line for line in plan)
+        report.append({'query': name, 'avg_ms': round(elapsed_ms, 3), 'uses_index': not full_scan, 'plan': plan})
+    return report
@@ -0,0 +1,554 @@
+import os
+import random
+import json
+import contextvars
+from flask import current_app
+from sqlalchemy import insert
+from models import db, Character, LifeEvent, Attribute, Perk, Choice, Achievement, touch_user
+from turn_jobs import TurnError
+from llm_backends import GeminiBackend, FakeBackend, JsonFieldStream
+from llm_budget import LatencyBudget, BudgetExceeded
+from narrator import local_year, local_attributes, local_turn_results, local_initial_years
+from llm_cache import ResponseCache
+from speculation import Speculator
+from metrics import metrics
+from memory import get_prompt_history
+from leaderboard import record_death
+
+# --- Game Constants ---
+ALL_PERKS = (
+    "Genius Intellect",
+    "Artistic Talent",
+    "Athletic Prowess",
+    "Charismatic Leader",
+    "Financial Mogul",
+    "Kind Heart",
+    "Resilient Body",
+    "Lucky Charm",
+    "Inventive Mind",
+    "Musical Prodigy",
+    "Master Negotiator",
+    "Photographic Memory",
+    "Night Owl Focus",
+    "Early Riser Energy",
+    "Perpetual Optimism",
+    "Skeptical Mind",
+    "Silver Tongue",
+    "Stone Cold Poker Face",
+    "Pack Rat Tendencies",
+    "Minimalist Lifestyle",
+    "Master Chef Skills",
+    "Gardening Green Thumb",
+    "DIY Handyman",
+    "Tech Savvy",
+    "Analog Lover",
+    "Boundless Curiosity",
+    "Commitment Phobe",
+    "Eternal Student",
+    "Natural Therapist",
+    "Cold-Blooded Calm",
+    "Hot-Temper Burst",
+    "Chronic Procrastination",
+    "Deadline Crusher",
+    "Serial Hobbyist",
+    "Collector's Eye",
+    "Travel Junkie",
+    "Homebody Comfort",
+    "Social Butterfly",
+    "Introvert Recharge",
+    "Photographer's Eye",
+    "Slow and Steady",
+    "Speed Demon",
+    "Perceptive Observer",
+    "Absent-Minded Professor",
+    "Wallflower Charm",
+    "Spotlight Seeker",
+    "Coincidence Magnet",
+    "Conspiracy Theorist",
+    "Lucky Penny Finder",
+    "Jinxed Luck",
+    "Silver Lining Finder",
+    "Perfectionist Tendencies",
+    "Happy-Go-Lucky",
+    "Blunt Honesty",
+    "White Lie Expert",
+    "Master of Small Talk",
+    "Deep Conversationalist",
+    "Emotionally Intuitive",
+    "Emotionally Reserved",
+    "Night Vision",
+    "Daydream Weaver",
+    "Memory Like a Sieve",
+    "Eidetic Recall",
+    "Street Smart",
+    "Book Smart",
+    "Natural Leader",
+    "Reluctant Follower",
+    "Team Player",
+    "Lone Wolf",
+    "Adaptive Chameleon",
+    "Stubborn as Ox",
+    "Flexible Thinker",
+    "Risk Averse",
+    "Gambler's Instinct",
+    "Safety First",
+    "Adrenaline Seeker",
+    "Cautious Investor",
+    "Impulsive Buyer",
+    "Savvy Saver",
+    "Generous Soul",
+    "Miserly Ways",
+    "Prankster Spirit",
+    "Serious Stoic",
+    "Optimized Routine",
+    "Chaotic Energy",
+    "Organizational Guru",
+    "Creative Mess",
+    "Multitasking Pro",
+    "Monotasking Master",
+    "Hyperfocused",
+    "Easily Distracted",
+    "Translator Tongue",
+    "Monolingual Comfort",
+    "Sense of Direction",
+    "Perpetual Lost",
+    "Negotiation Tactician",
+    "Concession Giver",
+    "Fashion Forward",
+    "Fashionably Late",
+    "DIY Medical Kit",
+    "Health Nut",
+    "Fast Healer",
+    "Fragile Constitution",
+    "Logical Analyzer",
+    "Spiritual Seeker",
+    "Animal Whisperer",
+    "Allergic to Pets",
+    "Green Thumb Failure",
+    "Crafty Maker",
+    "Tech-Phobic",
+    "Quick Wit",
+    "Dry Humor"
+)
+
+# For validating submitted perks: a new character picks exactly PERKS_PER_CHARACTER different ones from the catalog
+PERK_NAMES = frozenset(ALL_PERKS)
+PERKS_PER_CHARACTER = 3
+
+# Starting values, and the fallback for any stat the model leaves out
+DEFAULT_ATTRIBUTES = {"health": 100, "wealth": 500, "happiness": 75, "karma": 0, "iq": 100}
+
+# --- Model Services ---
+# Built per app by init_app() from its config (see config.py) rather than at import, so importing this module
+# starts nothing and two apps in one process don't share a backend or cache. Game functions use the current app's.
+# 'gemini' talks to the real API; 'fake' is a seeded offline stand-in for load tests and machines without network.
+# The fake backend's behaviour, the Gemini pool's limits and speculation's rate limits are tuned from the environment.
+def make_backend(kind):
+    if kind == 'fake':
+        return FakeBackend(
+            seed=int(os.getenv("FAKE_LLM_SEED", 0)),
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", 800)),
+            latency_jitter_ms=float(os.getenv("FAKE_LLM_LATENCY_JITTER_MS", 200)),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", 0)),
+            invalid_rate=float(os.getenv("FAKE_LLM_INVALID_RATE", 0)),
+            slow_rate=float(os.getenv("FAKE_LLM_SLOW_RATE", 0)),
+            slow_ms=float(os.getenv("FAKE_LLM_SLOW_MS", 0)),
+            keys=int(os.getenv("FAKE_LLM_KEYS", 1))
+        )
+    return GeminiBackend(
+        os.getenv("GEMINI_API_KEYS", "").split(','),
+        max_in_flight=int(os.getenv("GEMINI_MAX_IN_FLIGHT_PER_KEY", 4)),
+        cooldown=float(os.getenv("GEMINI_RATE_LIMIT_COOLDOWN", 60))
+    )
+
+class TurnServices:
+    def __init__(self, config):
+        self.backend = make_backend(config['LLM_BACKEND'])
+        # Every call runs against its task's budget; with 2+ keys a slow one is hedged on another key.
+        self.budget = LatencyBudget(config['LLM_TASK_BUDGETS'], default_budget=config['LLM_DEFAULT_BUDGET'],
+                                    hedging=config['LLM_HEDGING'], max_hedge_ratio=config['LLM_MAX_HEDGE_RATIO'])
+        self.cache = ResponseCache(config['LLM_CACHE_PATH'], max_entries=config['LLM_CACHE_MEMORY_ENTRIES'])
+        self.cache_ttls = dict(config['LLM_CACHE_TASKS'])
+        self.speculator = Speculator(
+            enabled=config['SPECULATION_ENABLED'],
+            candidates=int(os.getenv("SPECULATION_CANDIDATES", 2)),
+            user_calls_per_hour=int(os.getenv("SPECULATION_USER_CALLS_PER_HOUR", 120)),
+            key_calls_per_minute=int(os.getenv("SPECULATION_KEY_CALLS_PER_MINUTE", 10)),
+            ttl=int(os.getenv("SPECULATION_TTL", 900)),
+            workers=int(os.getenv("SPECULATION_WORKERS", 2))
+        )
+        self.turn_mode = config['TURN_MODE']
+        self.local_narrator = config['LOCAL_NARRATOR']
+        if not self.backend:
+            print("WARNING: Gemini API keys not found or are empty in .env file. The application may not function correctly.")
+
+def init_app(app):
+    services = app.extensions['game'] = TurnServices(app.config)
+    return services
+
+def services(): return current_app.extensions['game']
+
+# Whether this thread's latest model call was abandoned for running out of its budget
+_budget_exhausted = contextvars.ContextVar('budget_exhausted', default=False)
+
+def call_gemini_api(prompt_data, stream_field=None, on_text=None):
+    # With on_text, the response is streamed and each newly arrived part of the stream_field string is passed
+    # to on_text before the whole response has been parsed. Every call runs against its task's latency budget
+    # and is recorded as a span in metrics. Only answers that pass their task's validator are cached.
+    services_ = services()
+    backend, budget, cache = services_.backend, services_.budget, services_.cache
+    if not backend: return None
+    _budget_exhausted.set(False)
+    task = prompt_data.get('task')
+    cache_ttl = services_.cache_ttls.get(task)
+    with metrics.llm_span(task, backend.name) as span:
+        if cache_ttl:
+            cache_key = ResponseCache.key(prompt_data, backend.model_name)
+            cached = cache.get(cache_key)
+            if cached is not None and valid_response(task, cached):
+                span['outcome'] = 'cached'
+                if on_text and isinstance(cached, dict) and isinstance(cached.get(stream_field), str): on_text(cached[stream_field])
+                return cached
+        span['prompt_bytes'] = len(json.dumps(prompt_data))
+        try:
+            if on_text:
+                stream = JsonFieldStream(stream_field)
+                attempt = lambda timeout, avoid: backend.generate_stream(prompt_data, timeout, avoid)
+                for chunk in budget.run(task, attempt, streaming=True, key_count=backend.key_count):
+                    text = stream.feed(chunk)
+                    if text: on_text(text)
+                raw = stream.text
+            else:
+                attempt = lambda timeout, avoid: [backend.generate(prompt_data, timeout, avoid)]
+                raw = "".join(budget.run(task, attempt, key_count=backend.key_count))
+            span['response_bytes'] = len(raw)
+            result = json.loads(raw)
+        except BudgetExceeded as e:
+            span['outcome'] = 'timeout'
+            _budget_exhausted.set(True)
+            print(e)
+            return None
+        except json.JSONDecodeError as e:
+            span['outcome'] = 'invalid'
+            print(f"The {backend.name} backend returned JSON that could not be parsed: {e}")
+            return None
+        except Exception as e:
+            span['outcome'] = 'error'
+            print(f"An error occurred with the {backend.name} backend: {e}")
+            return None
+    if cache_ttl and valid_response(task, result): cache.set(cache_key, result, cache_ttl, task=task, model=backend.model_name, prompt_data=prompt_data)
+    return result
+
+def local_allowed(final_attempt):
+    # The local narrator stands in for a call that just ran out of its budget, or for any failure on the job's last
+    # attempt. A transient error, a parse error or an exhausted key pool is left for the job runner to retry.
+    return services().local_narrator and (final_attempt or _budget_exhausted.get())
+
+def valid_perks(perk_names):
+    return len(perk_names) == PERKS_PER_CHARACTER and len(set(perk_names)) == PERKS_PER_CHARACTER and PERK_NAMES.issuperset(perk_names)
+
+def new_character(user_id, name, gender, perk_names):
+    character = Character(user_id=user_id, name=name, gender=gender)
+    db.session.add(character); db.session.flush()
+    for perk_name in perk_names:
+        db.session.add(Perk(character_id=character.id, name=perk_name))
+    touch_user(user_id)
+    db.session.commit()
+    return character
+
+def generate_initial_life_story(character, hold=None, final_attempt=True):
+    # Works out the first five years, their attributes and the first choices, then writes them in one commit.
+    # Nothing is written on failure, so a retry starts from birth again. hold(), when given, runs just before
+    # the commit and raises if the job running this turn has lost it. final_attempt is False while the job
+    # running this can still retry (see local_allowed).
+    perk_names = [p.name for p in character.perks]
+    prompt1_data = {
+        "task": "generate_initial_narrative",
+        "instruction": "You are a life simulator AI. Create a narrative for the first 5 years of a character's life. The character is an infant and toddler during this period. Events MUST be appropriate for this age range (e.g., learning to walk, first words, playing with toys). Perks should manifest in subtle, nascent ways (e.g., a 'Genius' baby might be fascinated by patterns, not solving calculus).",
+        "character_details": { "name": character.name, "gender": character.gender, "perks": perk_names },
+        "response_schema": { "1": "Summary for year 1.", "2": "...", "3": "...", "4": "...", "5": "..." }
+    }
+    narrative_json = call_gemini_api(prompt1_data) or (local_initial_years(character, perk_names) if local_allowed(final_attempt) else None)
+    if not narrative_json: return False, "Failed to generate life story."
+    try:
+        full_summary = "\n".join(narrative_json.values())
+        events = [{"year": int(year), "summary": summary} for year, summary in narrative_json.items()]
+    except (TypeError, KeyError, AttributeError, ValueError) as e: return False, f"Received an invalid narrative format from the AI: {e}"
+
+    prompt2_data = {
+        "task": "evaluate_attributes_and_score",
+        "narrative": full_summary,
+        "response_schema": {
+            "health": "Integer 0-100", "wealth": "Integer, can be very large (e.g., 500, 10000, 1000000)",
+            "happiness": "Integer 0-100", "karma": "Integer -100 to 100",
+            "iq": "Integer 0-300", "life_score": "An integer score from 0-200 for this 5-year period."
+        }
+    }
+    attributes_json = call_gemini_api(prompt2_data) or (local_attributes(character, 5, DEFAULT_ATTRIBUTES, perk_names) if local_allowed(final_attempt) else None)
+    if not attributes_json: return False, "Failed to evaluate attributes."
+    try:
+        life_score = int(attributes_json.get('life_score', 0))
+        attributes = {stat: int(attributes_json.get(stat, default)) for stat, default in DEFAULT_ATTRIBUTES.items()}
+    except (TypeError, KeyError, ValueError, AttributeError): return False, "Received an invalid attribute format from the AI."
+
+    results_json = request_turn_results(character, 5, attributes, events) or (local_turn_results(character, 5, []) if local_allowed(final_attempt) else None)
+    if not results_json: return False, "Failed to generate initial choices and achievements."
+
+    db.session.execute(insert(LifeEvent), [dict(event, character_id=character.id) for event in events])
+    db.session.add(Attribute(character_id=character.id, year=5, **attributes))
+    character.age = 5
+    character.score += life_score
+    store_turn_results(character, results_json)
+    character.touch()
+    if hold: hold()
+    db.session.commit()
+    return True, "Success"
+
+def request_turn_results(character, age, attributes, life_history):
+    prompt3_data = {
+        "task": "generate_turn_results",
+        "instruction": "You are a life simulator AI. All generated choices and achievements MUST be realistic and appropriate for the character's specific age.",
+        "character_details": { "name": character.name, "age": age, "attributes": attributes },
+        "life_history": life_history,
+        "response_schema": { "choices": ["List of 10 string choices"], "achievements": ["List of string achievements"] }
+    }
+    results_json = call_gemini_api(prompt3_data)
+    return valid_turn_results(results_json) if results_json else None
+
+def valid_turn_results(data):
+    if not isinstance(data, dict): return None
+    choices, achievements = data.get('choices'), data.get('achievements', [])
+    if not isinstance(choices, list) or not choices or not isinstance(achievements, list): return None
+    if not all(isinstance(c, str) for c in choices + achievements): return None
+    return {"choices": choices, "achievements": achievements}
+
+def store_turn_results(character, results_json):
+    # Adds the next choices and the achievements to the session; the caller commits. Choices are all new each year,
+    # so they are replaced with one bulk insert. Achievements mostly carry over, so only the gained and lost ones are written.
+    Choice.query.filter_by(character_id=character.id).delete(synchronize_session=False)
+    db.session.execute(insert(Choice), [{"character_id": character.id, "description": c} for c in results_json["choices"]])
+    wanted, kept, lost = set(results_json["achievements"]), set(), []
+    for achievement_id, description in db.session.query(Achievement.id, Achievement.description).filter(Achievement.character_id == character.id):
+        if description in wanted and description not in kept: kept.add(description)
+        else: lost.append(achievement_id)
+    if lost: Achievement.query.filter(Achievement.id.in_(lost)).delete(synchronize_session=False)
+    gained = [{"character_id": character.id, "description": a} for a in dict.fromkeys(results_json["achievements"]) if a not in kept]
+    if gained: db.session.execute(insert(Achievement), gained)
+
+def valid_fused_narrative(data):
+    return isinstance(data, dict) and isinstance(data.get('summary'), str) and data['summary'].strip() != "" and isinstance(data.get('is_deceased', False), bool)
+
+def valid_initial_narrative(data):
+    return isinstance(data, dict) and bool(data) and all(str(year).isdigit() and isinstance(summary, str) for year, summary in data.items())
+
+def valid_attributes(data):
+    # Missing stats fall back to their defaults; the ones given must be integers.
+    if not isinstance(data, dict): return False
+    try:
+        for key in (*DEFAULT_ATTRIBUTES, 'life_score'):
+            if key in data: int(data[key])
+    except (TypeError, ValueError): return False
+    return True
+
+def fused_attributes(data):
+    # The fused response nests attributes; flatten them into the evaluate_attributes_and_score shape.
+    try:
+        attributes = {k: int(data['attributes'][k]) for k in DEFAULT_ATTRIBUTES}
+        attributes['life_score'] = int(data['life_score'])
+        return attributes
+    except (TypeError, KeyError, ValueError): return None
+
+# Checked before an answer is cached or replayed from the cache, so a malformed one is never served again.
+RESPONSE_VALIDATORS = {
+    'generate_initial_narrative': valid_initial_narrative, 'evaluate_attributes_and_score': valid_attributes,
+    'generate_turn_results': valid_turn_results, 'advance_year_narrative': valid_fused_narrative, 'advance_year_fused': valid_fused_narrative
+}
+
+def valid_response(task, data): return task in RESPONSE_VALIDATORS and bool(RESPONSE_VALIDATORS[task](data))
+
+def narrative_prompt(character, age, latest_attributes, life_history, player_choices):
+    # Modified prompt to inform the AI about the age-based death mechanic
+    return {
+        "task": "advance_year_narrative",
+        "instruction": f"You are a life simulator AI. The narrative summary MUST be realistic for the character's specific age. A 6-year-old starts school, a 90-year-old retires. The character is now {age} years old. Note that there's an increasing chance of natural death after age 60, which is handled by the game logic.",
+        "character_details": { "name": character.name, "age": age, "attributes": { "health": latest_attributes.health, "wealth": latest_attributes.wealth, "happiness": latest_attributes.happiness, "karma": latest_attributes.karma, "iq": latest_attributes.iq } },
+        "life_history": life_history,
+        "player_choices": player_choices,
+        "response_schema": { "summary": "A 5-8 sentence summary for the next year.", "is_deceased": "A boolean (true/false) indicating if the character died this year from events in the narrative (not old age)." }
+    }
+
+def fused_prompt(character, age, latest_attributes, life_history, player_choices):
+    return {
+        "task": "advance_year_fused",
+        "instruction": f"You are a life simulator AI. Write the next year of the character's life, then evaluate it and offer the next choices. Everything MUST be realistic for the character's specific age. A 6-year-old starts school, a 90-year-old retires. The character is now {age} years old. Note that there's an increasing chance of natural death after age 60, which is handled by the game logic.",
+        "character_details": { "name": character.name, "age": age, "attributes": { "health": latest_attributes.health, "wealth": latest_attributes.wealth, "happiness": latest_attributes.happiness, "karma": latest_attributes.karma, "iq": latest_attributes.iq } },
+        "life_history": life_history,
+        "player_choices": player_choices,
+        "response_schema": {
+            "summary": "A 5-8 sentence summary for the next year.",
+            "is_deceased": "A boolean (true/false) indicating if the character died this year from events in the narrative (not old age).",
+            "attributes": { "health": "Integer 0-100", "wealth": "Integer, can be very large", "happiness": "Integer 0-100", "karma": "Integer -100 to 100", "iq": "Integer 0-300" },
+            "life_score": "Integer 0-200 for this year.",
+            "choices": ["List of 10 string choices for the following year"],
+            "achievements": ["List of string achievements so far"]
+        }
+    }
+
+def request_year(character, prompt_data, on_text=None):
+    # Uses the speculative answer for exactly this prompt when there is one, otherwise asks the model.
+    speculator, backend = services().speculator, services().backend
+    if speculator.enabled and backend:
+        result = speculator.take(character.id, ResponseCache.key(prompt_data, backend.model_name))
+        if result is not None:
+            if on_text and isinstance(result, dict) and isinstance(result.get('summary'), str): on_text(result['summary'])
+            return result
+    return call_gemini_api(prompt_data, 'summary', on_text)
+
+def speculate_next_turn(character):
+    # Runs on a speculation worker once a year has been written: asks for the next year's narrative (the whole
+    # turn in fused mode) for the choice sets the player is most likely to submit. Writes nothing; the history
+    # digest it builds is rolled back.
+    speculator, backend = services().speculator, services().backend
+    if not character.is_alive or not backend: return
+    with db.session.no_autoflush:
+        latest_attributes = Attribute.query.filter_by(character_id=character.id).order_by(Attribute.year.desc()).first()
+        offered = [c.description for c in Choice.query.filter_by(character_id=character.id).order_by(Choice.id)]
+        if latest_attributes is None or not offered: return
+        build_prompt = fused_prompt if services().turn_mode == 'fused' else narrative_prompt
+        life_history = get_prompt_history(character)
+        for picks in speculator.likely_picks(offered):
+            prompt_data = build_prompt(character, character.age + 1, latest_attributes, life_history, picks)
+            if not speculator.allow(character.user_id, backend.key_count): break
+            result = call_gemini_api(prompt_data)
+            if result: speculator.put(character.id, ResponseCache.key(prompt_data, backend.model_name), result)
+    db.session.rollback()
+
+def advance_character_year(character, player_choices, turn_stats=None, publish=None, hold=None, final_attempt=True):
+    # Returns a (category, message) flash for the player, or None for an ordinary year.
+    # The year is worked out in full before anything is written, then written in one transaction, so no write lock
+    # is held while waiting on the model. On failure the session is rolled back and TurnError raised for the job runner to retry.
+    # turn_stats, when given, receives the mode used and which fused parts fell back to their own call, or to the
+    # local narrator ('local' for the whole year, 'local_attributes', 'local_turn_results').
+    # publish(event, data), when given, receives the year as it is worked out: the narrative text as the model
+    # streams it ('narrative'), 'reset' when that text is being replaced, then 'attributes' and 'choices'.
+    # hold(), when given, runs just before the year is committed and raises if the job has lost the turn.
+    # final_attempt is False while the job can still retry; until then only budget overruns go to the local narrator.
+    turn_stats = turn_stats if turn_stats is not None else {}
+    turn_stats.update(mode=services().turn_mode, fallbacks=[])
+    try:
+        with db.session.no_autoflush:
+            year = plan_year(character, character.age + 1, player_choices, turn_stats, publish, final_attempt)
+    except TurnError:
+        db.session.rollback()
+        raise
+    write_year(character, year, hold)
+    return year['flash']
+
+def plan_year(character, age, player_choices, turn_stats, publish=None, final_attempt=True):
+    # Everything the year will write. Only reads from the database; write_year applies it.
+    on_text = (lambda text: publish('narrative', {'text': text})) if publish else None
+    year = {'age': age, 'events': [], 'attributes': None, 'life_score': 0, 'turn_results': None, 'died': False, 'zeroed_attributes': None, 'flash': None}
+
+    # Check for death by old age if character is 60 or older
+    if age >= 60:
+        # The probability of death increases by 2.5% for each year over 59.
+        # at 60, probability is 2.5%
+        # at 70, probability is 27.5%
+        # at 100, probability is 102.5% (guaranteed death)
+        death_probability = (age - 59) * 0.025
+        if random.random() < death_probability:
+            # Add a life event for the death
+            year['events'].append(f"{character.name} passed away of natural causes at the age of {age}.")
+            if on_text: on_text(year['events'][0])
+            year['died'], year['flash'] = True, ("info", f"{character.name} has passed away at {age} years old.")
+            return year
+
+    latest_attributes = Attribute.query.filter_by(character_id=character.id).order_by(Attribute.year.desc()).first()
+    previous_attributes = {stat: getattr(latest_attributes, stat) for stat in DEFAULT_ATTRIBUTES}
+    perk_names = [p.name for p in character.perks]
+    achievements = lambda: [a.description for a in Achievement.query.filter_by(character_id=character.id).order_by(Achievement.id)]
+
+    fused = services().turn_mode == 'fused'
+    fused_json = request_year(character, fused_prompt(character, age, latest_attributes, get_prompt_history(character), player_choices), on_text) if fused else None
+    if fused_json is not None and not valid_fused_narrative(fused_json):
+        # The other parts were written against a narrative we are about to replace, so none of them can be kept.
+        turn_stats['fallbacks'].append('narrative')
+        fused_json = None
+    if fused and fused_json is None and publish: publish('reset', {})
+
+    if fused_json is None:
+        narrative_json = request_year(character, narrative_prompt(character, age, latest_attributes, get_prompt_history(character), player_choices), on_text)
+    else:
+        narrative_json = fused_json
+    if not (isinstance(narrative_json, dict) and 'summary' in narrative_json) and local_allowed(final_attempt):
+        # Nothing usable came back within the budget, or on the last attempt: the local narrator writes the whole year instead.
+        if publish: publish('reset', {})
+        narrative_json = fused_json = local_year(character, age, previous_attributes, perk_names, player_choices, achievements())
+        turn_stats['fallbacks'].append('local')
+        if on_text: on_text(narrative_json['summary'])
+    if not narrative_json: raise TurnError("The story could not continue. Please try again.")
+
+    try:
+        next_year_summary = narrative_json['summary']
+        is_deceased_from_event = narrative_json.get('is_deceased', False)
+    except (KeyError, TypeError, AttributeError): raise TurnError("Received an invalid story format from the AI.")
+    year['events'].append(next_year_summary)
+    if is_deceased_from_event:
+        year['died'], year['zeroed_attributes'] = True, latest_attributes
+        year['flash'] = ("info", f"{character.name} has passed away at the age of {age}.")
+        return year
+
+    fused_attributes_json = fused_attributes(fused_json) if fused_json else None
+    fused_results_json = valid_turn_results(fused_json) if fused_json else None
+    if fused_json and fused_attributes_json is None: turn_stats['fallbacks'].append('attributes')
+    if fused_json and fused_results_json is None: turn_stats['fallbacks'].append('turn_results')
+
+    prompt2_data = {
+        "task": "evaluate_attributes_and_score", "narrative": next_year_summary,
+        "previous_attributes": previous_attributes,
+        "response_schema": {
+            "health": "Integer 0-100", "wealth": "Integer, can be very large",
+            "happiness": "Integer 0-100", "karma": "Integer -100 to 100",
+            "iq": "Integer 0-300", "life_score": "Integer 0-200"
+        }
+    }
+    attributes_json = fused_attributes_json or call_gemini_api(prompt2_data)
+    if not attributes_json and services().local_narrator:
+        if not local_allowed(final_attempt): raise TurnError("The story could not continue. Please try again.")
+        attributes_json = local_attributes(character, age, previous_attributes, perk_names)
+        turn_stats['fallbacks'].append('local_attributes')
+    new_attributes = previous_attributes
+    if attributes_json:
+        try:
+            year['life_score'] = int(attributes_json.get('life_score', 0))
+            year['attributes'] = new_attributes = {stat: int(attributes_json.get(stat, previous_attributes[stat])) for stat in DEFAULT_ATTRIBUTES}
+            if publish: publish('attributes', dict(new_attributes, life_score=year['life_score']))
+            if new_attributes['health'] <= 0:
+                year['events'].append(f"{character.name}'s journey has come to an end due to poor health.")
+                year['died'], year['flash'] = True, ("info", f"{character.name} has passed away at the age of {age}.")
+                return year
+        except (TypeError, KeyError, ValueError, AttributeError): year['attributes'], year['life_score'] = None, 0
+
+    # The memory digest only sees committed events, so the year being written is appended by hand.
+    year['turn_results'] = fused_results_json or request_turn_results(character, age, new_attributes, get_prompt_history(character) + [{"year": age, "summary": next_year_summary}])
+    if not year['turn_results'] and services().local_narrator:
+        if not local_allowed(final_attempt): raise TurnError("The story could not continue. Please try again.")
+        year['turn_results'] = local_turn_results(character, age, achievements())
+        turn_stats['fallbacks'].append('local_turn_results')
+    if publish and year['turn_results']: publish('choices', year['turn_results'])
+    return year
+
+def write_year(character, year, hold=None):
+    character.age = year['age']
+    db.session.add_all([LifeEvent(character_id=character.id, year=year['age'], summary=summary) for summary in year['events']])
+    if year['attributes']:
+        db.session.add(Attribute(character_id=character.id, year=year['age'], **year['attributes']))
+        character.score += year['life_score']
+    if year['zeroed_attributes']: year['zeroed_attributes'].health = 0
+    if year['died']:
+        character.is_alive = False
+        record_death(character)
+    if year['turn_results']: store_turn_results(character, year['turn_results'])
+    character.touch()
+    if hold: hold()
+    db.session.commit()
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, or_, and_
+from sqlalchemy.orm import Session
+from models import db, User, Character, LeaderboardEntry, TurnJob
+
+LEADERBOARD_PAGE_SIZE = int(os.getenv("LEADERBOARD_PAGE_SIZE", 50))
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", 30))
+
+AGE_BRACKETS = {'under-30': (0, 29), '30-59': (30, 59), '60-79': (60, 79), '80-plus': (80, None)}
+TIME_WINDOWS = {'day': timedelta(days=1), 'week': timedelta(days=7), 'month': timedelta(days=30)}
+
+# First pages by (age_bracket, window). Deaths in this process clear it once they commit; the TTL bounds how
+# stale another worker process's copy can get.
+_top_cache = {}
+_top_cache_lock = threading.Lock()
+
+def invalidate_top_cache():
+    with _top_cache_lock:
+        _top_cache.clear()
+
+# Cleared after the commit rather than when the death is added: a page read in between would be cached without it.
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('leaderboard_changed', False): invalidate_top_cache()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('leaderboard_changed', None)
+
+def record_death(character):
+    # Called on every path that ends a life. Adds the row to the session; the caller's commit persists it.
+    fields = dict(
+        user_id=character.user_id, player_name=character.player.username if character.player else "Unknown",
+        character_name=character.name, age=character.age, score=character.score, died_at=datetime.utcnow()
+    )
+    entry = LeaderboardEntry.query.filter_by(character_id=character.id).first()
+    if entry is None:
+        entry = LeaderboardEntry(character_id=character.id, **fields)
+        db.session.add(entry)
+    else:
+        for name, value in fields.items(): setattr(entry, name, value)
+    db.session.info['leaderboard_changed'] = True
+    return entry
+
+def rebuild_leaderboard():
+    # Backfills the table from every dead Character, e.g. after upgrading an existing database. A death keeps the
+    # time already recorded for it, or else takes the time its last turn finished; with neither it stays unknown
+    # (NULL), which keeps it out of the time windows.
+    died_at = dict(db.session.query(LeaderboardEntry.character_id, LeaderboardEntry.died_at).filter(LeaderboardEntry.died_at.isnot(None)))
+    last_turns = dict(db.session.query(TurnJob.character_id, func.max(TurnJob.updated_at)).filter(TurnJob.state == 'done').group_by(TurnJob.character_id))
+    LeaderboardEntry.query.delete()
+    rows = db.session.query(Character, User.username).outerjoin(User, Character.user_id == User.id).filter(Character.is_alive == False)
+    count = 0
+    for character, username in rows:
+        db.session.add(LeaderboardEntry(character_id=character.id, user_id=character.user_id, player_name=username or "Unknown", character_name=character.name,
+                                        age=character.age, score=character.score, died_at=died_at.get(character.id) or last_turns.get(character.id)))
+        count += 1
+    db.session.commit()
+    invalidate_top_cache()
+    return count
+
+def _filtered(query, age_bracket, window):
+    if age_bracket in AGE_BRACKETS:
+        low, high = AGE_BRACKETS[age_bracket]
+        query = query.filter(LeaderboardEntry.age >= low)
+        if high is not None: query = query.filter(LeaderboardEntry.age <= high)
+    if window in TIME_WINDOWS:
+        query = query.filter(LeaderboardEntry.died_at >= datetime.utcnow() - TIME_WINDOWS[window])
+    return query
+
+def parse_cursor(cursor):
+    # "score:id:rank" of the last row on the previous page.
+    try:
+        score, entry_id, rank = (int(part) for part in cursor.split(':'))
+        return score, entry_id, rank
+    except (AttributeError, ValueError): return None
+
+def leaderboard_page(cursor=None, age_bracket=None, window=None, page_size=None):
+    # Keyset pagination over (score desc, id asc). Returns (rows, next_cursor); rows are dicts with their global rank.
+    page_size = page_size or LEADERBOARD_PAGE_SIZE
+    after = parse_cursor(cursor)
+    cache_key = (age_bracket, window, page_size)
+    if after is None:
+        with _top_cache_lock:
+            cached = _top_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic(): return cached[1]
+
+    query = _filtered(LeaderboardEntry.query, age_bracket, window)
+    rank = 0
+    if after:
+        score, entry_id, rank = after
+        query = query.filter(or_(LeaderboardEntry.score < score, and_(LeaderboardEntry.score == score, LeaderboardEntry.id > entry_id)))
+    entries = query.order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.id).limit(page_size + 1).all()
+
+    rows = [{
+        'rank': rank + i + 1, 'player_name': e.player_name, 'character_name': e.character_name,
+        'character_id': e.character_id, 'age': e.age, 'score': e.score
+    } for i, e in enumerate(entries[:page_size])]
+    next_cursor = None
+    if len(entries) > page_size:
+        last = entries[page_size - 1]
+        next_cursor = f"{last.score}:{last.id}:{rank + page_size}"
+    page = (rows, next_cursor)
+    if after is None:
+        with _top_cache_lock:
+            _top_cache[cache_key] = (time.monotonic() + LEADERBOARD_CACHE_TTL, page)
+    return page
+
+def user_best_rank(user_id, age_bracket=None, window=None):
+    # The player's best finished life and where it stands, ties broken the same way as the page order.
+    best = _filtered(LeaderboardEntry.query.filter_by(user_id=user_id), age_bracket, window).order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.id).first()
+    if best is None: return None
+    ahead = _filtered(LeaderboardEntry.query, age_bracket, window).filter(
+        or_(LeaderboardEntry.score > best.score, and_(LeaderboardEntry.score == best.score, LeaderboardEntry.id < best.id))
+    ).count()
+    return {'rank': ahead + 1, 'character_name': best.character_name, 'score': best.score, 'age': best.age}
@@ -0,0 +1,258 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from llm_pool import GeminiClientPool
+from metrics import metrics
+
+
+class LLMBackend:
+    # A backend turns one prompt dict into the model's raw JSON text. call_gemini_api handles parsing,
+    # caching, latency budgets and error reporting, so backends only need generate() and stats(). timeout is
+    # the seconds left in the call's budget; avoid is the set of key indexes other attempts at the same call
+    # are using (see LatencyBudget.run).
+    name = 'base'
+    model_name = None
+    key_count = 1 # API keys behind the backend, for budgets that scale with them
+
+    def __bool__(self): return True
+
+    def generate(self, prompt_data, timeout=None, avoid=None): raise NotImplementedError
+
+    def generate_stream(self, prompt_data, timeout=None, avoid=None):
+        # Yields the same text in pieces as the model produces it; backends that can't stream send it whole.
+        yield self.generate(prompt_data, timeout, avoid)
+
+    def stats(self): return {'backend': self.name}
+
+
+class GeminiBackend(LLMBackend):
+    name = 'gemini'
+
+    def __init__(self, api_keys, model_name='gemini-1.5-flash', max_in_flight=4, cooldown=60.0):
+        self.pool = GeminiClientPool(api_keys, model_name=model_name, max_in_flight=max_in_flight, cooldown=cooldown)
+        self.model_name = model_name
+
+    def __bool__(self): return bool(self.pool)
+
+    @property
+    def key_count(self): return len(self.pool.slots)
+
+    def generate(self, prompt_data, timeout=None, avoid=None):
+        response = self.pool.generate(json.dumps(prompt_data), self._generation_config(), timeout, avoid)
+        self._record_usage(response)
+        return response.text
+
+    def generate_stream(self, prompt_data, timeout=None, avoid=None):
+        for chunk in self.pool.generate_stream(json.dumps(prompt_data), self._generation_config(), timeout, avoid):
+            self._record_usage(chunk) # the final chunk carries the totals
+            yield chunk.text
+
+    def _generation_config(self):
+        import google.generativeai as genai # imported on first use, like the pool's client libraries
+        return genai.types.GenerationConfig(response_mime_type="application/json")
+
+    def _record_usage(self, response):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage and usage.prompt_token_count: metrics.annotate_llm(prompt_tokens=usage.prompt_token_count, response_tokens=usage.candidates_token_count)
+
+    def stats(self): return dict(self.pool.stats(), backend=self.name)
+
+
+class FakeBackendError(Exception):
+    pass
+
+
+class FakeBackend(LLMBackend):
+    # Offline stand-in that answers every task in game.py with schema-valid JSON after a simulated delay.
+    # Each answer is drawn from an RNG seeded by (seed, prompt, how often that prompt was seen), so a run
+    # replays identically however the worker threads interleave (hedged calls aside, which ask twice). slow_rate
+    # of calls take slow_ms longer, the tail that latency budgets and hedging are there for; keys is how
+    # many API keys it pretends to have.
+    name = 'fake'
+    model_name = 'fake'
+
+    THINGS = ["a red kite", "an old piano", "the neighbour's dog", "a chess set", "a battered bicycle", "a library card", "a garden plot", "a second-hand camera"]
+    PLACES = ["the park", "school", "the seaside", "a small workshop", "the city library", "a community hall", "a quiet café", "the countryside"]
+    CHOICES_BY_STAGE = {
+        'child': ["Join a sports team", "Learn to play an instrument", "Make a new best friend", "Read every book in the library", "Start a collection", "Enter the science fair", "Take swimming lessons", "Help out at home", "Try out for the school play", "Spend summers outdoors", "Learn to code", "Start drawing every day"],
+        'adult': ["Ask for a promotion", "Start a small business", "Move to a new city", "Go back to school", "Invest in the stock market", "Adopt a pet", "Travel abroad", "Start a family", "Buy a house", "Run a marathon", "Volunteer every weekend", "Change careers"],
+        'senior': ["Retire early", "Write a memoir", "Take up gardening", "Mentor young people", "Travel the world", "Reconnect with old friends", "Downsize the home", "Learn a new language", "Join a choir", "Spend time with grandchildren", "Donate to charity", "Take long daily walks"]
+    }
+    FIRST_CHUNK_SHARE = 0.15
+    ACHIEVEMENTS = ["First Steps", "Honour Roll", "Team Captain", "First Paycheck", "Home Owner", "Marathon Finisher", "Published Author", "Community Hero", "World Traveller", "Beloved Mentor"]
+
+    def __init__(self, seed=0, latency_ms=800, latency_jitter_ms=200, error_rate=0.0, invalid_rate=0.0, slow_rate=0.0, slow_ms=0, keys=1):
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.key_count = keys
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, prompt_data):
+        digest = hashlib.sha256(json.dumps(prompt_data, sort_keys=True).encode('utf-8')).hexdigest()
+        with self._lock:
+            self.calls += 1
+            occurrence = self._seen[digest] = self._seen.get(digest, 0) + 1
+        return random.Random(f"{self.seed}:{digest}:{occurrence}")
+
+    def _answer(self, prompt_data):
+        # (latency in seconds, raw text), or None for the text when this call is a simulated failure.
+        rng = self._rng(prompt_data)
+        latency = max(0.0, rng.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000
+        roll = rng.random()
+        if roll < self.error_rate:
+            with self._lock: self.errors += 1
+            return latency, None
+        if roll < self.error_rate + self.invalid_rate:
+            return latency, '{"truncated": '
+        task = prompt_data.get('task')
+        responder = getattr(self, f"_{task}", None)
+        text = json.dumps(responder(rng, prompt_data) if responder else {})
+        # No tokenizer here; about four characters a token keeps the token metrics populated in development.
+        metrics.annotate_llm(prompt_tokens=len(json.dumps(prompt_data)) // 4, response_tokens=len(text) // 4)
+        # Drawn last, so turning the tail on leaves every answer as it was.
+        if self.slow_rate and rng.random() < self.slow_rate: latency += self.slow_ms / 1000
+        return latency, text
+
+    def _lease(self, avoid):
+        # The lowest pretend key no other attempt at this call is using.
+        key = min(set(range(self.key_count)) - (avoid or set()), default=0)
+        if avoid is not None: avoid.add(key)
+        metrics.annotate_llm(key=key, retries=0)
+
+    def _wait(self, seconds, timeout):
+        # Sleeps like a request with a deadline: past timeout it gives up the way a real client would.
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            with self._lock: self.timeouts += 1
+            raise TimeoutError("Simulated request deadline exceeded.")
+        time.sleep(seconds)
+
+    def generate(self, prompt_data, timeout=None, avoid=None):
+        self._lease(avoid)
+        latency, text = self._answer(prompt_data)
+        self._wait(latency, timeout)
+        if text is None: raise FakeBackendError("Simulated model failure.")
+        return text
+
+    def generate_stream(self, prompt_data, timeout=None, avoid=None):
+        # The same answer generate() gives, word by word: the first word after FIRST_CHUNK_SHARE of the latency,
+        # the rest spread over the remainder, roughly how a hosted model streams.
+        self._lease(avoid)
+        latency, text = self._answer(prompt_data)
+        started = time.monotonic()
+        self._wait(latency * self.FIRST_CHUNK_SHARE, timeout)
+        if text is None: raise FakeBackendError("Simulated model failure.")
+        pieces = re.findall(r'\s*\S+', text) or [text]
+        for i, piece in enumerate(pieces):
+            if i: self._wait(latency * (1 - self.FIRST_CHUNK_SHARE) / len(pieces), None if timeout is None else max(0.0, timeout - (time.monotonic() - started)))
+            yield piece
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'seed': self.seed, 'calls': self.calls, 'simulated_errors': self.errors, 'timeouts': self.timeouts,
+                    'latency_ms': self.latency_ms, 'error_rate': self.error_rate, 'invalid_rate': self.invalid_rate,
+                    'slow_rate': self.slow_rate, 'slow_ms': self.slow_ms, 'keys': self.key_count}
+
+    # --- Task responders ---
+    def _sentences(self, rng, name, age, count):
+        templates = [
+            "{name} spent many afternoons at {place} with {thing}.",
+            "At {age}, {name} surprised everyone with a new interest in {thing}.",
+            "A visit to {place} left {name} with a story to tell for years.",
+            "{name} made a friend at {place} who shared a love of {thing}.",
+            "Money was tight for a while, but {name} found joy in small things like {thing}.",
+            "{name} learned a hard lesson at {place} and grew from it.",
+            "By the end of the year, {name} felt more confident than ever.",
+            "Family gatherings at {place} became a highlight of the year for {name}."
+        ]
+        return " ".join(rng.choice(templates).format(name=name, age=age, place=rng.choice(self.PLACES), thing=rng.choice(self.THINGS)) for _ in range(count))
+
+    def _attributes(self, rng, previous):
+        previous = previous or {"health": 100, "wealth": 500, "happiness": 75, "karma": 0, "iq": 100}
+        clamp = lambda value, low, high: max(low, min(high, value))
+        return {
+            "health": clamp(int(previous.get('health', 100)) + rng.randint(-6, 3), 0, 100),
+            "wealth": max(0, int(int(previous.get('wealth', 500)) * rng.uniform(0.9, 1.3)) + rng.randint(0, 2000)),
+            "happiness": clamp(int(previous.get('happiness', 75)) + rng.randint(-8, 8), 0, 100),
+            "karma": clamp(int(previous.get('karma', 0)) + rng.randint(-5, 6), -100, 100),
+            "iq": clamp(int(previous.get('iq', 100)) + rng.randint(-1, 2), 0, 300)
+        }
+
+    def _turn_results(self, rng, age):
+        stage = 'child' if age < 18 else 'adult' if age < 60 else 'senior'
+        return {"choices": rng.sample(self.CHOICES_BY_STAGE[stage], 10), "achievements": self.ACHIEVEMENTS[:min(len(self.ACHIEVEMENTS), age // 8)]}
+
+    def _generate_initial_narrative(self, rng, prompt_data):
+        name = prompt_data['character_details']['name']
+        return {str(year): self._sentences(rng, name, year, 3) for year in range(1, 6)}
+
+    def _evaluate_attributes_and_score(self, rng, prompt_data):
+        return dict(self._attributes(rng, prompt_data.get('previous_attributes')), life_score=rng.randint(20, 160))
+
+    def _generate_turn_results(self, rng, prompt_data):
+        return self._turn_results(rng, int(prompt_data['character_details']['age']))
+
+    def _advance_year_narrative(self, rng, prompt_data):
+        details = prompt_data['character_details']
+        return {"summary": self._sentences(rng, details['name'], details['age'], rng.randint(5, 8)), "is_deceased": rng.random() < 0.003}
+
+    def _advance_year_fused(self, rng, prompt_data):
+        details = prompt_data['character_details']
+        return dict(
+            self._advance_year_narrative(rng, prompt_data), attributes=self._attributes(rng, details.get('attributes')),
+            life_score=rng.randint(20, 160), **self._turn_results(rng, int(details['age']))
+        )
+
+
+
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class JsonFieldStream:
+    # Decodes one string field of a JSON object while the object is still arriving, so its text can be shown
+    # before the closing brace. feed() returns the part of the field's value decoded from the new chunk;
+    # text holds everything received, for json.loads once the stream ends.
+    def __init__(self, field):
+        self.pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.text = ''
+        self.pos = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        if self.done: return ''
+        if self.pos is None:
+            match = self.pattern.search(self.text)
+            if not match: return ''
+            self.pos = match.end()
+        decoded, i, text = [], self.pos, self.text
+        while i < len(text):
+            c = text[i]
+            if c == '"':
+                self.done = True
+                break
+            if c != '\\':
+                decoded.append(c); i += 1
+                continue
+            # An escape split across chunks waits for the next one.
+            if i + 1 >= len(text): break
+            if text[i + 1] == 'u':
+                # Characters outside the BMP come as a surrogate pair, two escapes that decode together.
+                width = 12 if 0xD800 <= int(text[i + 2:i + 6].ljust(4, '0'), 16) < 0xDC00 else 6
+                if i + width > len(text): break
+                decoded.append(json.loads(f'"{text[i:i + width]}"')); i += width
+            else:
+                decoded.append(JSON_ESCAPES.get(text[i + 1], text[i + 1])); i += 2
+        self.pos = i
+        return ''.join(decoded)
@@ -0,0 +1,137 @@
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+HEDGE_MIN_DELAY = 0.05 # never hedge sooner than this, however fast the task usually answers
+HEDGE_SAMPLES = 200
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class LatencyBudget:
+    # Runs each model call against a per-task deadline. A call that hasn't produced its first chunk by the
+    # task's recent p95 gets a hedged duplicate on another API key, and whichever answers first is used. A losing
+    # stream stops at its next chunk, but a losing non-streaming call can't be interrupted: it keeps its key
+    # lease and runs until the API answers (bounded by the deadline), and its answer is dropped. Past the
+    # deadline the call is abandoned with BudgetExceeded. Hedges are capped at max_hedge_ratio of all calls, so
+    # the extra load, losers included, stays within that share.
+    def __init__(self, budgets=None, default_budget=30.0, hedging=True, hedge_quantile=0.95, hedge_min_samples=20, max_hedge_ratio=0.1, workers=32):
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-call')
+        self.samples = {} # (task, streaming) -> recent seconds to first chunk
+        self.counts = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_exceeded': 0}
+        self._lock = threading.Lock()
+
+    def budget(self, task): return float(self.budgets.get(task, self.default_budget))
+
+    def hedge_delay(self, task, streaming):
+        # Before enough samples are in, hedge at half the budget.
+        with self._lock:
+            samples = sorted(self.samples.get((task, streaming), ()))
+        if len(samples) < self.hedge_min_samples: return self.budget(task) / 2
+        return max(HEDGE_MIN_DELAY, samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))])
+
+    def _record(self, task, streaming, seconds):
+        with self._lock:
+            self.samples.setdefault((task, streaming), deque(maxlen=HEDGE_SAMPLES)).append(seconds)
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.counts['hedged'] >= self.max_hedge_ratio * self.counts['calls']: return False
+            self.counts['hedged'] += 1
+            return True
+
+    def run(self, task, attempt, streaming=False, key_count=1):
+        # attempt(timeout, avoid) returns an iterable of response text chunks. avoid is a set shared by the
+        # call's attempts; backends with several keys add the key they use and skip keys already in it.
+        # Yields the winning attempt's chunks.
+        started = time.monotonic()
+        deadline = started + self.budget(task)
+        hedge_at = started + self.hedge_delay(task, streaming) if self.hedging and key_count > 1 else None
+        with self._lock: self.counts['calls'] += 1
+        events, avoid, cancels, spans = queue.Queue(), set(), [], []
+
+        def work(n, cancel, span):
+            chunks = None
+            try:
+                with metrics.llm_attempt(span):
+                    chunks = iter(attempt(max(0.0, deadline - time.monotonic()), avoid))
+                    for chunk in chunks:
+                        if cancel.is_set(): return
+                        events.put((n, 'chunk', chunk))
+                events.put((n, 'end', None))
+            except Exception as e:
+                events.put((n, 'error', e))
+            finally:
+                if hasattr(chunks, 'close'): chunks.close()
+
+        def launch():
+            cancel, span = threading.Event(), {}
+            cancels.append(cancel); spans.append(span)
+            metrics.annotate_llm(attempts=len(cancels))
+            # A copy of the caller's context, so the attempt's backend sees the call's metrics span.
+            self.executor.submit(contextvars.copy_context().run, work, len(cancels) - 1, cancel, span)
+
+        launch()
+        winner, failed = None, 0
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    with self._lock: self.counts['budget_exceeded'] += 1
+                    if winner is None: metrics.annotate_llm(**spans[-1])
+                    raise BudgetExceeded(f"{task} gave no answer within its {self.budget(task):g}s budget.")
+                wait_until = min(deadline, hedge_at) if winner is None and hedge_at else deadline
+                try:
+                    n, kind, value = events.get(timeout=max(0.0, wait_until - now))
+                except queue.Empty:
+                    if winner is None and hedge_at and time.monotonic() >= hedge_at:
+                        hedge_at = None
+                        if self._may_hedge(): launch()
+                    continue
+                if winner is None and kind in ('chunk', 'end'):
+                    winner = n
+                    for i, cancel in enumerate(cancels):
+                        if i != n: cancel.set()
+                    self._record(task, streaming, time.monotonic() - started)
+                    if n:
+                        with self._lock: self.counts['hedge_wins'] += 1
+                    metrics.annotate_llm(hedge_won=bool(n), **spans[n])
+                # An attempt that gave up at the deadline it was handed ran out of budget; the check above reports it so.
+                if kind == 'error' and time.monotonic() >= deadline and (winner is None or n == winner): continue
+                if n != winner:
+                    if kind == 'error' and winner is None:
+                        failed += 1
+                        if failed < len(cancels): continue
+                        # Every attempt so far failed outright: try another key straight away if a hedge is still allowed.
+                        if hedge_at and self._may_hedge():
+                            hedge_at = None
+                            launch()
+                            continue
+                        metrics.annotate_llm(**spans[n])
+                        raise value
+                    continue
+                if kind == 'chunk': yield value
+                elif kind == 'end': return
+                else: raise value
+        finally:
+            for cancel in cancels: cancel.set()
+
+    def stats(self):
+        with self._lock:
+            counts, sampled = dict(self.counts), {key: len(samples) for key, samples in self.samples.items()}
+        name = lambda task, streaming: f"{task} (stream)" if streaming else task
+        return dict(counts, hedging=self.hedging, default_budget=self.default_budget, budgets=self.budgets,
+                    samples={name(*key): count for key, count in sampled.items()},
+                    hedge_after={name(*key): round(self.hedge_delay(*key), 3) for key in sampled})
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def parse_task_ttls(spec):
+    # "task=seconds,task=seconds" -> {"task": seconds}
+    ttls = {}
+    for item in spec.split(','):
+        task, _, ttl = item.partition('=')
+        if task.strip() and ttl.strip(): ttls[task.strip()] = int(ttl)
+    return ttls
+
+
+class ResponseCache:
+    # Content-addressed cache of parsed model responses: a bounded in-memory LRU in front of a SQLite file.
+    # Entries are keyed on the canonical prompt JSON plus the model name, and the prompt is stored with the
+    # response so a cached turn can be replayed exactly when debugging.
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def key(prompt_data, model_name):
+        canonical = json.dumps(prompt_data, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{model_name}\n{canonical}".encode('utf-8')).hexdigest()
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, task TEXT, model TEXT, prompt TEXT, response TEXT, created_at REAL, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_task ON llm_cache (task)")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return entry[1]
+            self._memory.pop(key, None)
+        row = self._db().execute("SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self.hits['disk'] += 1
+            return value
+
+    def set(self, key, value, ttl, task=None, model=None, prompt_data=None):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + ttl, value)
+        conn = self._db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, task, model, prompt, response, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, task, model, json.dumps(prompt_data) if prompt_data is not None else None, json.dumps(value), now, now + ttl)
+            )
+
+    def purge(self, task=None, expired_only=False):
+        conn = self._db()
+        clauses, params = [], []
+        if task: clauses.append("task = ?"); params.append(task)
+        if expired_only: clauses.append("expires_at <= ?"); params.append(time.time())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with conn:
+            purged = conn.execute(f"DELETE FROM llm_cache{where}", params).rowcount
+        with self._lock:
+            # The memory tier doesn't know tasks, so any targeted purge simply drops it; it refills from disk.
+            self._memory.clear()
+        return purged
+
+    def stats(self):
+        rows = self._db().execute("SELECT task, COUNT(*) FROM llm_cache WHERE expires_at > ? GROUP BY task", (time.time(),)).fetchall()
+        with self._lock:
+            lookups = self.misses + sum(self.hits.values())
+            return {
+                'memory_entries': len(self._memory), 'max_memory_entries': self.max_entries,
+                'disk_entries': {task: count for task, count in rows},
+                'hits': dict(self.hits), 'misses': self.misses,
+                'hit_rate': round(sum(self.hits.values()) / lookups, 3) if lookups else None
+            }
@@ -0,0 +1,155 @@
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from metrics import metrics
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def gevent_patched():
+    # True under a gevent server (gunicorn -k gevent), which patches the standard library's blocking calls.
+    monkey = sys.modules.get('gevent.monkey')
+    return bool(monkey and monkey.is_module_patched('socket'))
+
+
+class KeySlot:
+    def __init__(self, index, api_key):
+        self.index = index
+        self.api_key = api_key
+        self.model = None
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+
+    def healthy(self, now): return self.cooldown_until <= now
+
+    def stats(self, now):
+        return {
+            'index': self.index, 'in_flight': self.in_flight, 'calls': self.calls, 'errors': self.errors,
+            'rate_limited': self.rate_limited, 'cooling_down_for': max(0.0, round(self.cooldown_until - now, 1))
+        }
+
+
+class GeminiClientPool:
+    # One prepared GenerativeModel per API key, each bound to its own client instead of the
+    # process-global genai.configure(), so concurrent turns never swap keys under each other. The Google client
+    # libraries take about a second to import, so they load with the first call rather than with the app.
+    def __init__(self, api_keys, model_name='gemini-1.5-flash', max_in_flight=4, cooldown=60.0, acquire_timeout=30.0):
+        self.slots = [KeySlot(i, key) for i, key in enumerate(k.strip() for k in api_keys if k.strip())]
+        self.model_name = model_name
+        self.max_in_flight = max_in_flight
+        self.cooldown = cooldown
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+
+    def __bool__(self): return bool(self.slots)
+
+    def _prepare(self, slot):
+        import google.generativeai as genai
+        from google.ai import generativelanguage as glm
+        model = genai.GenerativeModel(self.model_name)
+        # gRPC would block a gevent server's event loop; the REST transport goes through its patched sockets.
+        transport = {'transport': 'rest'} if gevent_patched() else {}
+        model._client = glm.GenerativeServiceClient(client_options={'api_key': slot.api_key}, **transport)
+        return model
+
+    def _pick(self, now, exclude):
+        candidates = [s for s in self.slots if s.index not in exclude and s.in_flight < self.max_in_flight]
+        healthy = [s for s in candidates if s.healthy(now)]
+        if healthy: return min(healthy, key=lambda s: (s.in_flight, s.calls))
+        return None
+
+    @contextmanager
+    def lease(self, exclude=(), timeout=None):
+        deadline = time.monotonic() + (self.acquire_timeout if timeout is None else min(self.acquire_timeout, timeout))
+        with self._cond:
+            while True:
+                now = time.time()
+                slot = self._pick(now, exclude)
+                if slot: break
+                if all(s.index in exclude for s in self.slots): raise PoolExhausted("Every Gemini API key was tried for this call.")
+                # Sleep until a call finishes or the soonest cooldown ends, whichever comes first.
+                cooling = [s.cooldown_until - now for s in self.slots if s.index not in exclude and not s.healthy(now)]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise PoolExhausted("No Gemini API key became available in time.")
+                self._cond.wait(min([remaining] + cooling))
+            slot.in_flight += 1
+            slot.calls += 1
+            if slot.model is None: slot.model = self._prepare(slot)
+        try:
+            yield slot
+        finally:
+            with self._cond:
+                slot.in_flight -= 1
+                self._cond.notify()
+
+    def mark_error(self, slot, rate_limited=False):
+        with self._cond:
+            slot.errors += 1
+            if rate_limited:
+                slot.rate_limited += 1
+                slot.cooldown_until = time.time() + self.cooldown
+
+    def generate(self, prompt_text, generation_config, timeout=None, avoid=None):
+        # Runs one generate_content call, moving to the next healthy key whenever a key answers 429. timeout bounds
+        # the wait for a key and the request itself. avoid, when given, is a set of key indexes shared with other
+        # attempts at the same call (a hedge): those keys are skipped, and the key used is added to it.
+        from google.api_core.exceptions import TooManyRequests
+        tried, started = set(), time.monotonic()
+        while True:
+            remaining = None if timeout is None else timeout - (time.monotonic() - started)
+            with self.lease(exclude=tried | (avoid or set()), timeout=remaining) as slot:
+                if avoid is not None: avoid.add(slot.index)
+                metrics.annotate_llm(key=slot.index, retries=len(tried))
+                try:
+                    return slot.model.generate_content(prompt_text, generation_config=generation_config, request_options=self._request_options(timeout, started))
+                except TooManyRequests:
+                    self.mark_error(slot, rate_limited=True)
+                    tried.add(slot.index)
+                except Exception:
+                    self.mark_error(slot)
+                    raise
+
+    def generate_stream(self, prompt_text, generation_config, timeout=None, avoid=None):
+        # Streaming generate(): yields response chunks while holding the key's lease. A 429 can only move
+        # to another key before the first chunk has been handed out.
+        from google.api_core.exceptions import TooManyRequests
+        tried, started = set(), time.monotonic()
+        while True:
+            remaining = None if timeout is None else timeout - (time.monotonic() - started)
+            with self.lease(exclude=tried | (avoid or set()), timeout=remaining) as slot:
+                if avoid is not None: avoid.add(slot.index)
+                metrics.annotate_llm(key=slot.index, retries=len(tried))
+                streamed = False
+                try:
+                    for chunk in slot.model.generate_content(prompt_text, generation_config=generation_config, stream=True, request_options=self._request_options(timeout, started)):
+                        streamed = True
+                        yield chunk
+                    return
+                except TooManyRequests:
+                    self.mark_error(slot, rate_limited=True)
+                    if streamed: raise
+                    tried.add(slot.index)
+                except Exception:
+                    self.mark_error(slot)
+                    raise
+
+    def _request_options(self, timeout, started):
+        # What is left of the call's timeout once a key was leased.
+        if timeout is None: return None
+        return {'timeout': max(0.1, timeout - (time.monotonic() - started))}
+
+    def stats(self):
+        now = time.time()
+        with self._cond:
+            slots = [s.stats(now) for s in self.slots]
+        return {
+            'model': self.model_name, 'max_in_flight_per_key': self.max_in_flight,
+            'healthy_keys': sum(1 for s in self.slots if s.healthy(now)),
+            'in_flight': sum(s['in_flight'] for s in slots), 'keys': slots
+        }
@@ -0,0 +1,78 @@
+import os
+import re
+import json
+from models import LifeEvent, LifeMemory
+
+# --- Memory Configuration ---
+MEMORY_RECENT_YEARS = int(os.getenv("MEMORY_RECENT_YEARS", 10))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 1500))
+DECADE_SUMMARY_CHARS = 600
+
+def estimate_tokens(data):
+    # Roughly four characters per token for English prose; good enough to budget prompts.
+    return len(json.dumps(data)) // 4 + 1
+
+def first_sentence(text):
+    match = re.match(r'(.+?[.!?])(\s|$)', text.strip(), re.S)
+    return match.group(1) if match else text.strip()
+
+def decade_line(entry): return f"{entry['year']}: {first_sentence(entry['summary'])}"
+
+def condense(lines, limit=DECADE_SUMMARY_CHARS):
+    # One decade's "year: first sentence" lines as a single entry of about limit characters. A full decade is
+    # re-condensed by clipping every line evenly, so its later years are kept too.
+    text = " ".join(lines)
+    if len(text) <= limit: return text
+    quota = max(limit // len(lines) - 1, 12)
+    return " ".join(line if len(line) <= quota else line[:quota - 1].rstrip() + "…" for line in lines)
+
+def load_decades(memory):
+    # decade -> its years' lines. Digests written before lines were kept hold one condensed string per decade.
+    return {d: [lines] if isinstance(lines, str) else lines for d, lines in json.loads(memory.decades).items()}
+
+def update_memory(character):
+    # Folds any LifeEvents newer than the high-water mark into the digest; older years roll out of
+    # the verbatim window into their decade's condensed entry.
+    memory = character.memory
+    if memory is None:
+        memory = LifeMemory(character_id=character.id, version=0, last_event_id=0, recent='[]', decades='{}', full_history_tokens=0, tokens_saved=0)
+        character.memory = memory
+    new_events = LifeEvent.query.filter(LifeEvent.character_id == character.id, LifeEvent.id > memory.last_event_id).order_by(LifeEvent.id).all()
+    if not new_events: return memory
+
+    recent, decades = json.loads(memory.recent), load_decades(memory)
+    for event in new_events:
+        entry = {"year": event.year, "summary": event.summary}
+        recent.append(entry)
+        memory.full_history_tokens += estimate_tokens(entry)
+    recent.sort(key=lambda e: e['year'])
+    years = sorted({e['year'] for e in recent})
+    if len(years) > MEMORY_RECENT_YEARS:
+        cutoff = years[-MEMORY_RECENT_YEARS]
+        for entry in (e for e in recent if e['year'] < cutoff):
+            decades.setdefault(str(entry['year'] // 10 * 10), []).append(decade_line(entry))
+        recent = [e for e in recent if e['year'] >= cutoff]
+
+    memory.recent, memory.decades = json.dumps(recent), json.dumps(decades)
+    memory.last_event_id = new_events[-1].id
+    memory.version += 1
+    return memory
+
+def get_prompt_history(character, token_budget=None):
+    # Drop-in replacement for the full event list in prompts: condensed decades, then recent years verbatim.
+    # Over the token budget, the verbatim window shrinks first (its oldest years roll into their decades, for
+    # this prompt only); decade entries are dropped from the oldest end only once a single recent year is left.
+    # Digest changes are left unflushed and go out with the caller's turn commit.
+    memory = update_memory(character)
+    budget = token_budget or MEMORY_TOKEN_BUDGET
+    recent, decades = json.loads(memory.recent), load_decades(memory)
+    build = lambda: [{"years": f"{d}-{int(d) + 9}", "summary": condense(lines)} for d, lines in sorted(decades.items(), key=lambda item: int(item[0]))] + recent
+    history = build()
+    while len(recent) > 1 and estimate_tokens(history) > budget:
+        entry = recent.pop(0)
+        decades.setdefault(str(entry['year'] // 10 * 10), []).append(decade_line(entry))
+        history = build()
+    while len(history) > 1 and estimate_tokens(history) > budget:
+        history.pop(0)
+    memory.tokens_saved += max(0, memory.full_history_tokens - estimate_tokens(history))
+    return history
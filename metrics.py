@@ -0,0 +1,233 @@
+import os
+import time
+import random
+import cProfile
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+# What the current request or turn has spent on SQL ([count, seconds]), and the model call in progress.
+_query_scope = contextvars.ContextVar('query_scope', default=None)
+_llm_span = contextvars.ContextVar('llm_span', default=None)
+
+
+def _labels(names, values):
+    if not names: return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names, self.buckets = name, help_text, tuple(label_names), tuple(buckets)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None: series = self.series[label_values] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), label_values + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), label_values + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(label_names)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labels(self.label_names, values)} {value}" for values, value in sorted(self.series.items())]
+        return lines
+
+
+class Metrics:
+    # In-process instrumentation, rendered in the Prometheus text format at /metrics: request latency and SQL
+    # per route, duration and SQL per turn job, and a span for every model call. Each worker process keeps its
+    # own numbers, like the other in-process stats. Only the opt-in turn profiler adds real overhead.
+    def __init__(self, app=None):
+        self.http_latency = Histogram('http_request_duration_seconds', "Time to build the response, by route.", ('endpoint', 'method', 'status'))
+        self.http_queries = Histogram('http_request_queries', "SQL statements run per request.", ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.http_query_time = Histogram('http_request_query_seconds', "Time spent in SQL per request.", ('endpoint',))
+        self.turn_latency = Histogram('turn_job_duration_seconds', "Turn job handler time per attempt.", ('kind', 'outcome'), LATENCY_BUCKETS + (60.0, 120.0))
+        self.turn_queries = Histogram('turn_job_queries', "SQL statements run per turn job attempt.", ('kind',), QUERY_COUNT_BUCKETS)
+        self.turn_query_time = Histogram('turn_job_query_seconds', "Time spent in SQL per turn job attempt.", ('kind',))
+        self.llm_latency = Histogram('llm_call_duration_seconds', "Model call time, by task and outcome.", ('task', 'backend', 'outcome'), LATENCY_BUCKETS + (60.0,))
+        self.llm_calls = Counter('llm_calls_total', "Model calls by task, API key index and outcome.", ('task', 'key', 'outcome'))
+        self.llm_retries = Counter('llm_retries_total', "Calls moved to another API key after a 429.", ('task',))
+        self.llm_bytes = Counter('llm_bytes_total', "Prompt and response bytes.", ('task', 'direction'))
+        self.llm_tokens = Counter('llm_tokens_total', "Prompt and response tokens as reported by the backend.", ('task', 'direction'))
+        self.llm_hedges = Counter('llm_hedges_total', "Calls that sent a hedged duplicate to a second API key, by whether the duplicate answered first.", ('task', 'won'))
+        self.profiles = Counter('turn_profiles_total', "Turn attempts run under the sampling profiler.", ('kind',))
+        self.gauges = []
+        self.spans = deque(maxlen=200)
+        self.profile_rate = 0.0
+        self.profile_dir = None
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.profile_rate = app.config.get('TURN_PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_dir = app.config.get('TURN_PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._end_request)
+        app.extensions['metrics'] = self
+
+    def gauge(self, name, help_text, read):
+        # A value read when /metrics is scraped, e.g. open streams or keys in flight.
+        self.gauges.append((name, help_text, read))
+
+    # --- Requests ---
+    def _start_request(self):
+        request.environ['metrics.started'] = time.perf_counter()
+        request.environ['metrics.scope_token'] = _query_scope.set([0, 0.0])
+
+    def _finish_request(self, response):
+        started, scope = request.environ.get('metrics.started'), _query_scope.get()
+        if started is not None and scope is not None:
+            endpoint = request.endpoint or 'unmatched'
+            self.http_latency.observe(time.perf_counter() - started, endpoint, request.method, str(response.status_code))
+            self.http_queries.observe(scope[0], endpoint)
+            self.http_query_time.observe(scope[1], endpoint)
+        return response
+
+    def _end_request(self, exc):
+        token = request.environ.pop('metrics.scope_token', None)
+        if token is not None: _query_scope.reset(token)
+
+    # --- Turn jobs ---
+    def turn(self, kind):
+        # Wraps a turn job handler: records each attempt's duration, outcome and SQL, and runs a sampled
+        # share of attempts under cProfile when TURN_PROFILE_SAMPLE_RATE is set.
+        def decorate(func):
+            @wraps(func)
+            def wrapped(*args, **kwargs):
+                token, started, outcome = _query_scope.set([0, 0.0]), time.perf_counter(), 'error'
+                try:
+                    with self.profiled(kind):
+                        result = func(*args, **kwargs)
+                    outcome = 'ok'
+                    return result
+                finally:
+                    queries, query_time = _query_scope.get()
+                    _query_scope.reset(token)
+                    self.turn_latency.observe(time.perf_counter() - started, kind, outcome)
+                    self.turn_queries.observe(queries, kind)
+                    self.turn_query_time.observe(query_time, kind)
+            return wrapped
+        return decorate
+
+    @contextmanager
+    def profiled(self, kind):
+        if not self.profile_rate or random.random() >= self.profile_rate:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"turn-{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{os.getpid()}.prof"))
+            self.profiles.inc(1, kind)
+
+    # --- Model calls ---
+    @contextmanager
+    def llm_span(self, task, backend):
+        # Backends fill in what only they know (key index, retries, token counts) through annotate_llm().
+        span = {'task': task, 'backend': backend, 'outcome': 'ok', 'key': None, 'retries': 0, 'prompt_bytes': 0, 'response_bytes': 0,
+                'prompt_tokens': None, 'response_tokens': None, 'started_at': time.time()}
+        token, started = _llm_span.set(span), time.perf_counter()
+        try:
+            yield span
+        except Exception:
+            span['outcome'] = 'error'
+            raise
+        finally:
+            _llm_span.reset(token)
+            duration = time.perf_counter() - started
+            span['duration_ms'] = round(duration * 1000, 1)
+            self.llm_latency.observe(duration, task, backend, span['outcome'])
+            self.llm_calls.inc(1, task, 'none' if span['key'] is None else str(span['key']), span['outcome'])
+            if span['retries']: self.llm_retries.inc(span['retries'], task)
+            self.llm_bytes.inc(span['prompt_bytes'], task, 'prompt')
+            self.llm_bytes.inc(span['response_bytes'], task, 'response')
+            if span['prompt_tokens'] is not None: self.llm_tokens.inc(span['prompt_tokens'], task, 'prompt')
+            if span['response_tokens'] is not None: self.llm_tokens.inc(span['response_tokens'], task, 'response')
+            if span.get('attempts', 1) > 1: self.llm_hedges.inc(1, task, 'true' if span.get('hedge_won') else 'false')
+            self.spans.append(span)
+
+    @contextmanager
+    def llm_attempt(self, span):
+        # One of several concurrent attempts at the same call (a hedged call): the backend annotates this
+        # attempt's own dict, and the caller copies the winner's fields into the call's span.
+        token = _llm_span.set(span)
+        try:
+            yield span
+        finally:
+            _llm_span.reset(token)
+
+    def annotate_llm(self, **fields):
+        span = _llm_span.get()
+        if span is not None: span.update(fields)
+
+    # --- Export ---
+    def render(self):
+        lines = []
+        for metric in (self.http_latency, self.http_queries, self.http_query_time, self.turn_latency, self.turn_queries, self.turn_query_time,
+                       self.llm_latency, self.llm_calls, self.llm_retries, self.llm_bytes, self.llm_tokens, self.llm_hedges, self.profiles):
+            lines += metric.render()
+        for name, help_text, read in self.gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+    def recent_spans(self):
+        return list(self.spans)
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if _query_scope.get() is not None: conn.info['metrics.query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    scope, started = _query_scope.get(), conn.info.pop('metrics.query_started', None)
+    if scope is not None and started is not None:
+        scope[0] += 1
+        scope[1] += time.perf_counter() - started
@@ -0,0 +1,137 @@
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import update
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
+
+db = SQLAlchemy()
+
+
+def touch_user(user_id):
+    # Done in SQL so concurrent turns of the same player can't lose an increment.
+    db.session.execute(update(User).where(User.id == user_id).values(version=User.version + 1))
+
+
+# --- Database Models ---
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), unique=True, nullable=False)
+    password_hash = db.Column(db.String(200), nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    characters = db.relationship('Character', backref='player', lazy=True)
+    def set_password(self, password): self.password_hash = generate_password_hash(password)
+    def check_password(self, password): return check_password_hash(self.password_hash, password)
+
+class Character(db.Model):
+    __table_args__ = (
+        db.Index('ix_character_alive_score', 'is_alive', 'score'),
+        db.Index('ix_character_user_alive', 'user_id', 'is_alive'),
+        db.Index('ix_character_alive_archived', 'is_alive', 'archived'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    gender = db.Column(db.String(50), nullable=False)
+    is_alive = db.Column(db.Boolean, default=True, nullable=False)
+    age = db.Column(db.Integer, default=0)
+    score = db.Column(db.Integer, default=0)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    archived = db.Column(db.Boolean, default=False, nullable=False) # row-per-year data moved into ArchivedLife
+    events = db.relationship('LifeEvent', backref='character', lazy=True, cascade="all, delete-orphan")
+    attributes = db.relationship('Attribute', backref='character', lazy=True, cascade="all, delete-orphan")
+    perks = db.relationship('Perk', backref='character', lazy=True, cascade="all, delete-orphan")
+    choices = db.relationship('Choice', backref='character', lazy=True, cascade="all, delete-orphan")
+    achievements = db.relationship('Achievement', backref='character', lazy=True, cascade="all, delete-orphan")
+    memory = db.relationship('LifeMemory', backref='character', uselist=False, cascade="all, delete-orphan")
+
+    def touch(self):
+        # Bumps the counters behind the life_view and dashboard ETags; every write that changes what either page shows calls it.
+        self.version = (self.version or 0) + 1
+        touch_user(self.user_id)
+
+class LifeEvent(db.Model):
+    __table_args__ = (db.Index('ix_life_event_character_year', 'character_id', 'year'),)
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+
+class Attribute(db.Model):
+    __table_args__ = (db.Index('ix_attribute_character_year', 'character_id', 'year'),)
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    health = db.Column(db.Integer, default=100)
+    wealth = db.Column(db.BigInteger, default=500) # Changed to BigInteger
+    happiness = db.Column(db.Integer, default=75)
+    karma = db.Column(db.Integer, default=0)
+    iq = db.Column(db.Integer, default=100)
+
+class Perk(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+
+class Choice(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False, index=True)
+    description = db.Column(db.String(255), nullable=False)
+
+class Achievement(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False, index=True)
+    description = db.Column(db.String(255), nullable=False)
+
+class LifeMemory(db.Model):
+    # Rolling digest of a character's LifeEvents: the last few years verbatim plus one condensed entry per older decade.
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), unique=True, nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    last_event_id = db.Column(db.Integer, default=0, nullable=False) # high-water mark of digested events
+    recent = db.Column(db.Text, default='[]', nullable=False) # [{"year", "summary"}]
+    decades = db.Column(db.Text, default='{}', nullable=False) # {"10": ["10: first sentence", ...], ...}, condensed when prompted
+    full_history_tokens = db.Column(db.Integer, default=0, nullable=False)
+    tokens_saved = db.Column(db.Integer, default=0, nullable=False)
+
+class ArchivedLife(db.Model):
+    # A finished life's events, attributes, perks, choices and achievements packed into one compressed JSON blob
+    # (see archive.py), so the per-year tables only hold lives still being played.
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), unique=True, nullable=False)
+    codec = db.Column(db.String(10), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class LeaderboardEntry(db.Model):
+    # Denormalized copy of a finished life, written when the character dies, so the leaderboard never joins or scans Character.
+    __table_args__ = (db.Index('ix_leaderboard_entry_score_id', db.desc('score'), 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    player_name = db.Column(db.String(100), nullable=False)
+    character_name = db.Column(db.String(100), nullable=False)
+    age = db.Column(db.Integer, nullable=False, index=True)
+    score = db.Column(db.Integer, nullable=False)
+    died_at = db.Column(db.DateTime, index=True) # set by record_death; NULL when a backfilled death's time isn't known
+
+class TurnJob(db.Model):
+    # Not a foreign key: a failed 'create' job deletes its character but the job row stays for the poller.
+    __table_args__ = (db.Index('ix_turn_job_character_state', 'character_id', 'state'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    character_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False) # 'create' or 'advance'
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=False)
+    payload = db.Column(db.Text, default='{}')
+    state = db.Column(db.String(20), default='queued', nullable=False) # queued -> running -> done | failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    category = db.Column(db.String(20))
+    message = db.Column(db.Text)
+    notified = db.Column(db.Boolean, default=False, nullable=False)
+    tokens_saved = db.Column(db.Integer, default=0, nullable=False)
+    turn_mode = db.Column(db.String(20)) # 'chained' or 'fused', for comparing latency between modes
+    fallbacks = db.Column(db.String(100)) # fused parts that had to be re-requested on their own, or parts the local narrator wrote
+    duration_ms = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -0,0 +1,97 @@
+import random
+
+# Local stand-in for the model, used when a call fails or runs out of its latency budget: a plain, deterministic
+# year built from templates, the character's perks, age and last attributes, in the same shapes the model answers
+# with. It keeps a turn moving; it isn't meant to read as well as the model does.
+
+# Yearly nudges each perk gives, on top of the drift that comes with age
+PERK_EFFECTS = {
+    "Genius Intellect": {"iq": 2}, "Photographic Memory": {"iq": 1}, "Inventive Mind": {"iq": 1, "wealth": 300},
+    "Quick Wit": {"iq": 1, "happiness": 1}, "Night Owl Focus": {"iq": 1, "health": -1}, "Early Riser Energy": {"health": 1},
+    "Artistic Talent": {"happiness": 2}, "Musical Prodigy": {"happiness": 2}, "Crafty Maker": {"happiness": 1, "wealth": 200},
+    "Athletic Prowess": {"health": 2}, "Resilient Body": {"health": 2}, "Charismatic Leader": {"karma": 1, "wealth": 400},
+    "Financial Mogul": {"wealth": 1500}, "Master Negotiator": {"wealth": 800}, "Lucky Charm": {"wealth": 500, "happiness": 1},
+    "Kind Heart": {"karma": 3}, "Spiritual Seeker": {"karma": 2, "happiness": 1}, "Animal Whisperer": {"karma": 1, "happiness": 1},
+    "Perpetual Optimism": {"happiness": 3}, "Dry Humor": {"happiness": 1}, "Allergic to Pets": {"health": -1},
+    "Green Thumb Failure": {"happiness": -1}, "Tech-Phobic": {"wealth": -200}
+}
+
+PERK_MOMENTS = {
+    'child': ["{perk} showed in the way {name} played and asked questions", "teachers began to notice {name}'s {perk}", "{name}'s {perk} made for a few proud moments at home"],
+    'adult': ["{name} leaned on {perk} at work more than once", "friends came to count on {name}'s {perk}", "{perk} opened a door or two for {name}"],
+    'senior': ["{perk} still served {name} well", "{name} passed on some of that {perk} to the younger ones", "the family often remarked on {name}'s {perk}"]
+}
+YEAR_OPENINGS = {
+    'child': ["{name} turned {age} in a busy, happy household.", "At {age}, {name} spent most days between school and play.", "{name}'s {age}th year was full of small discoveries."],
+    'adult': ["{name} turned {age} and settled into a steady routine.", "At {age}, {name} balanced work, friends and family.", "{name}'s {age}th year brought its usual mix of chores and celebrations."],
+    'senior': ["{name} turned {age} and took life at a gentler pace.", "At {age}, {name} had more time for the people who mattered.", "{name}'s {age}th year was a quiet, reflective one."]
+}
+YEAR_CLOSINGS = ["It was not a remarkable year, but it was a good one.", "By the end of the year {name} felt ready for whatever came next.",
+                 "There were ups and downs, and {name} came through them.", "{name} ended the year with a few new stories to tell."]
+INFANT_YEARS = ["{name} was born into a loving family and spent the first year eating, sleeping and watching the world.",
+                "{name} took a first few wobbly steps and said a first word, to great applause.",
+                "{name} discovered picture books, building blocks and the word \"no\".",
+                "{name} made a first friend at playgroup and would not stop asking \"why?\".",
+                "{name} got ready for school, already showing a little of what was to come."]
+CHOICES_BY_STAGE = {
+    'child': ["Study hard for the next test", "Join an after-school club", "Spend more time outdoors", "Learn a musical instrument", "Make new friends",
+              "Help out around the house", "Start a hobby", "Read more books", "Try a new sport", "Spend time with grandparents", "Enter a school competition", "Save up pocket money"],
+    'adult': ["Focus on your career", "Save more money", "Take up a new hobby", "Travel somewhere new", "Spend more time with family", "Get in better shape",
+              "Learn a new skill", "Volunteer in the community", "Move to a new home", "Reconnect with old friends", "Start a side project", "Take a long holiday"],
+    'senior': ["Spend time with family", "Take up gardening", "Travel while you still can", "Write down your memories", "Volunteer locally", "Take daily walks",
+               "Learn something new", "Reconnect with old friends", "Simplify your home", "Mentor someone younger", "Join a local club", "Rest and enjoy life"]
+}
+
+
+def _stage(age): return 'child' if age < 18 else 'adult' if age < 60 else 'senior'
+
+def _clamp(value, low, high): return max(low, min(high, value))
+
+def _rng(character, age): return random.Random(f"local:{character.id}:{age}")
+
+
+def local_attributes(character, age, previous, perk_names):
+    # The previous year's attributes, drifted for age and nudged by the perks, plus a modest life_score.
+    rng = _rng(character, age)
+    deltas = {"health": 0, "wealth": 0, "happiness": rng.randint(-2, 2), "karma": 0, "iq": 0}
+    for perk in perk_names:
+        for stat, change in PERK_EFFECTS.get(perk, {}).items(): deltas[stat] += change
+    if age < 25: deltas["iq"] += 1
+    if age > 40: deltas["health"] -= (age - 40) // 10 + rng.randint(0, 1)
+    if 18 <= age < 65: deltas["wealth"] += 1000 + rng.randint(0, 1000)
+    attributes = {
+        "health": _clamp(int(previous["health"]) + deltas["health"], 0, 100),
+        "wealth": max(0, int(previous["wealth"]) + deltas["wealth"]),
+        "happiness": _clamp(int(previous["happiness"]) + deltas["happiness"], 0, 100),
+        "karma": _clamp(int(previous["karma"]) + deltas["karma"], -100, 100),
+        "iq": _clamp(int(previous["iq"]) + deltas["iq"], 0, 300)
+    }
+    return dict(attributes, life_score=_clamp(40 + (attributes["happiness"] - 50) // 2 + attributes["karma"] // 10, 0, 200))
+
+def local_turn_results(character, age, achievements):
+    # Ten choices for the character's stage of life; achievements already earned are kept as they are.
+    return {"choices": _rng(character, age).sample(CHOICES_BY_STAGE[_stage(age)], 10), "achievements": list(achievements)}
+
+def local_year(character, age, previous, perk_names, player_choices, achievements):
+    # A whole year in the advance_year_fused shape: summary, is_deceased, attributes, life_score, choices, achievements.
+    rng, stage = _rng(character, age), _stage(age)
+    sentences = [rng.choice(YEAR_OPENINGS[stage]).format(name=character.name, age=age)]
+    for choice in player_choices[:3]:
+        sentences.append(f"Having decided to \"{choice}\", {character.name} followed through as best as {rng.choice(['they could', 'life allowed'])}.")
+    for perk in rng.sample(perk_names, min(2, len(perk_names))):
+        moment = rng.choice(PERK_MOMENTS[stage]).format(name=character.name, perk=perk.lower())
+        sentences.append(moment[0].upper() + moment[1:] + ".")
+    sentences.append(rng.choice(YEAR_CLOSINGS).format(name=character.name))
+    attributes = local_attributes(character, age, previous, perk_names)
+    life_score = attributes.pop("life_score")
+    return dict({"summary": " ".join(sentences), "is_deceased": False, "attributes": attributes, "life_score": life_score},
+                **local_turn_results(character, age, achievements))
+
+def local_initial_years(character, perk_names):
+    # The first five years in the generate_initial_narrative shape ({"1": summary, ..., "5": summary}).
+    years = {}
+    for year, template in enumerate(INFANT_YEARS, start=1):
+        summary = template.format(name=character.name)
+        if year == 5 and perk_names: summary += f" Even now, there were hints of {perk_names[0].lower()}."
+        years[str(year)] = summary
+    return years
@@ -0,0 +1,209 @@
+"""Headless life simulator and turn-path benchmark.
+
+Runs whole lives, from character creation to death, through the same game.py pipeline the web app's
+turn workers use, but with no HTTP in between. Lives are spread over a process pool against a scratch
+database, and the run reports throughput, turn latency percentiles and database write volume.
+
+    python simulator.py --lives 1000 --processes 8 --backend fake --latency-ms 50
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from flask import Flask
+from sqlalchemy import event
+import game
+from models import db, User
+from config import Config
+from database import engine_settings, upgrade_database
+from turn_jobs import TurnError
+from llm_backends import FakeBackend
+
+MAX_TURNS_PER_LIFE = 150 # the old-age roll guarantees death by 100, so this only guards against a stuck life
+TURN_ATTEMPTS = 3
+
+_app = None
+_writes = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def create_engine_app(database_uri, **settings):
+    # Just the database half of the web app: no routes, no login manager, no turn queue. settings override the
+    # production config the game's model services are built from.
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(settings)
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_settings(database_uri)
+    db.init_app(app)
+    return app
+
+
+def count_writes(engine, counters):
+    # On SQLite rows are counted per transaction from total_changes: cursor.rowcount reads 0 for the
+    # INSERT ... RETURNING batches the ORM flushes with, which would hide most inserts.
+    def changes(conn):
+        return getattr(conn.connection.dbapi_connection, 'total_changes', None)
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        conn.info['changes_at_begin'] = changes(conn)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(' ', 1)[0].upper()
+        if verb in ('INSERT', 'UPDATE', 'DELETE'):
+            counters['statements'] += 1
+            if changes(conn) is None: counters['rows'] += max(cursor.rowcount, 0)
+
+    @event.listens_for(engine, 'commit')
+    def commit(conn):
+        counters['commits'] += 1
+        before, after = conn.info.pop('changes_at_begin', None), changes(conn)
+        if before is not None and after is not None: counters['rows'] += after - before
+
+
+def init_worker(database_uri, backend_options, turn_mode, cache_path, budget_settings=None):
+    global _app, _writes
+    settings = dict(budget_settings or {})
+    if backend_options is not None: settings['LLM_BACKEND'] = 'fake'
+    if turn_mode: settings['TURN_MODE'] = turn_mode
+    # A scratch cache keeps benchmark prompts out of the app's cache; no path means caching is off.
+    if cache_path: settings['LLM_CACHE_PATH'] = cache_path
+    else: settings['LLM_CACHE_TASKS'] = {}
+    _app = create_engine_app(database_uri, **settings)
+    services = game.init_app(_app)
+    if backend_options is not None: services.backend = FakeBackend(**backend_options)
+    _writes = {'statements': 0, 'rows': 0, 'commits': 0}
+    with _app.app_context():
+        count_writes(db.engine, _writes)
+
+
+def simulate_life(user_id, rng, result):
+    # Plays one character from birth to death, picking up to three of the offered choices each year.
+    # Returns the wall time of every turn, or None if the first five years could not be generated.
+    # Years the local narrator had to write are counted in result['local_turns'].
+    character = game.new_character(user_id, f"Sim {rng.randint(1000, 9999)}", rng.choice(["Male", "Female", "Non-binary"]), rng.sample(game.ALL_PERKS, 3))
+    success, _ = game.generate_initial_life_story(character)
+    if not success: return None
+    turn_latencies = []
+    while character.is_alive and len(turn_latencies) < MAX_TURNS_PER_LIFE:
+        offered = [c.description for c in character.choices]
+        picked = rng.sample(offered, min(len(offered), rng.randint(1, 3)))
+        started = time.perf_counter()
+        for attempt in range(TURN_ATTEMPTS):
+            try:
+                turn_stats = {}
+                game.advance_character_year(character, picked, turn_stats, final_attempt=attempt == TURN_ATTEMPTS - 1)
+                if 'local' in turn_stats['fallbacks']: result['local_turns'] += 1
+                break
+            except TurnError:
+                db.session.rollback()
+        else:
+            break
+        turn_latencies.append(time.perf_counter() - started)
+    return turn_latencies
+
+
+def run_lives(task):
+    # Process-pool entry point: simulates a batch of lives and reports what it measured.
+    lives, batch_seed = task
+    rng = random.Random(batch_seed)
+    random.seed(batch_seed) # the old-age death roll in game.py draws from the module-level RNG
+    before = dict(_writes)
+    result = {'lives': 0, 'failed_lives': 0, 'turns': 0, 'local_turns': 0, 'turn_latencies': []}
+    with _app.app_context():
+        user = User(username=f"sim-{os.getpid()}-{batch_seed}", password_hash="!")
+        db.session.add(user); db.session.commit()
+        for _ in range(lives):
+            latencies = simulate_life(user.id, rng, result)
+            if latencies is None:
+                result['failed_lives'] += 1
+                continue
+            result['lives'] += 1
+            result['turns'] += len(latencies)
+            result['turn_latencies'].extend(latencies)
+        db.session.remove()
+    result['writes'] = {k: _writes[k] - before[k] for k in _writes}
+    return result
+
+
+def run_benchmark(lives, processes, database_uri, backend_options=None, turn_mode=None, use_cache=True, seed=0, batch_size=5, budget_settings=None):
+    cache_path = os.path.join(tempfile.mkdtemp(prefix='lifesim-cache-'), 'llm_cache.db') if use_cache else None
+    setup_app = create_engine_app(database_uri)
+    with setup_app.app_context():
+        upgrade_database()
+        db.engine.dispose()
+
+    batches, remaining, batch_seed = [], lives, seed
+    while remaining > 0:
+        batches.append((min(batch_size, remaining), batch_seed))
+        remaining -= batch_size; batch_seed += 1
+
+    totals = {'lives': 0, 'failed_lives': 0, 'turns': 0, 'local_turns': 0, 'turn_latencies': [], 'writes': {'statements': 0, 'rows': 0, 'commits': 0}}
+    context = multiprocessing.get_context('spawn')
+    started = time.perf_counter()
+    with context.Pool(processes, initializer=init_worker, initargs=(database_uri, backend_options, turn_mode, cache_path, budget_settings)) as pool:
+        for result in pool.imap_unordered(run_lives, batches):
+            for key in ('lives', 'failed_lives', 'turns', 'local_turns'): totals[key] += result[key]
+            totals['turn_latencies'].extend(result['turn_latencies'])
+            for key, value in result['writes'].items(): totals['writes'][key] += value
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(totals.pop('turn_latencies'))
+    turns = max(totals['turns'], 1)
+    return dict(
+        totals, processes=processes, elapsed_s=round(elapsed, 3),
+        lives_per_s=round(totals['lives'] / elapsed, 3), turns_per_s=round(totals['turns'] / elapsed, 3),
+        turn_p50_ms=round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        turn_p99_ms=round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        commits_per_turn=round(totals['writes']['commits'] / turns, 2), rows_written_per_turn=round(totals['writes']['rows'] / turns, 2)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate whole lives outside the web app and benchmark the turn path.")
+    parser.add_argument('--lives', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--database', help="SQLAlchemy URI; defaults to a fresh SQLite file in a temp directory")
+    parser.add_argument('--backend', choices=['fake', 'configured'], default='fake', help="'configured' uses the production config's LLM_BACKEND")
+    parser.add_argument('--latency-ms', type=float, default=0, help="fake backend latency per call")
+    parser.add_argument('--latency-jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--invalid-rate', type=float, default=0)
+    parser.add_argument('--slow-rate', type=float, default=0, help="share of fake calls that take --slow-ms longer")
+    parser.add_argument('--slow-ms', type=float, default=0)
+    parser.add_argument('--keys', type=int, default=1, help="API keys the fake backend pretends to have (hedging needs 2+)")
+    parser.add_argument('--budget-ms', type=float, help="one latency budget for every task instead of LLM_TASK_BUDGETS")
+    parser.add_argument('--no-hedging', action='store_true')
+    parser.add_argument('--turn-mode', choices=['chained', 'fused'])
+    parser.add_argument('--no-cache', action='store_true', help="bypass the LLM response cache")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    database_uri = args.database or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='lifesim-'), 'bench.db')}"
+    backend_options = None
+    if args.backend == 'fake':
+        backend_options = {'seed': args.seed, 'latency_ms': args.latency_ms, 'latency_jitter_ms': args.latency_jitter_ms, 'error_rate': args.error_rate, 'invalid_rate': args.invalid_rate,
+                           'slow_rate': args.slow_rate, 'slow_ms': args.slow_ms, 'keys': args.keys}
+    budget_settings = {'LLM_HEDGING': not args.no_hedging}
+    if args.budget_ms is not None: budget_settings.update(LLM_TASK_BUDGETS={}, LLM_DEFAULT_BUDGET=args.budget_ms / 1000)
+    report = run_benchmark(args.lives, args.processes, database_uri, backend_options, args.turn_mode, not args.no_cache, args.seed, budget_settings=budget_settings)
+    report['database'] = database_uri
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items(): print(f"{key:>22}: {value}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
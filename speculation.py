@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import Counter, deque
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_PICKS = 3
+
+
+class Speculator:
+    # Model answers worked out for a character's next year while the player is still choosing. Each one is
+    # keyed by the exact prompt the turn would send (ResponseCache.key), so a turn can only consume work done
+    # for the same history, attributes and choices. Guesses the player doesn't make are counted as wasted calls.
+    def __init__(self, enabled=False, candidates=2, user_calls_per_hour=120, key_calls_per_minute=10, ttl=900, workers=2):
+        self.enabled = enabled
+        self.candidates = candidates
+        self.user_calls_per_hour = user_calls_per_hour
+        self.key_calls_per_minute = key_calls_per_minute
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='speculation') if enabled else None
+        self.pending = {} # character_id -> {prompt key: (expires_at, result)}
+        # How often players picked each position of the offered list, and how many they picked; starts flat.
+        self.position_picks = Counter({i: 1 for i in range(10)})
+        self.pick_counts = Counter({n: 1 for n in range(1, MAX_PICKS + 1)})
+        self.counts = Counter()
+        self._user_calls = {}
+        self._key_calls = deque()
+        self._lock = threading.Lock()
+
+    def schedule(self, func, *args):
+        if not self.enabled: return
+        with self._lock: self.counts['scheduled'] += 1
+        self.executor.submit(func, *args)
+
+    def observe(self, offered, picked):
+        # Learns from a submitted turn which positions and how many choices players tend to pick.
+        positions = [offered.index(choice) for choice in picked if choice in offered]
+        if not positions: return
+        with self._lock:
+            self.position_picks.update(positions)
+            self.pick_counts[min(len(positions), MAX_PICKS)] += 1
+
+    def likely_picks(self, offered):
+        # The most probable submissions, each in display order as the form sends them: P(count) times the
+        # subset's share of all same-size subsets, weighted by how popular each position is.
+        with self._lock:
+            weights = [self.position_picks[i] or 1 for i in range(len(offered))]
+            count_total = sum(self.pick_counts.values())
+            count_share = {n: self.pick_counts[n] / count_total for n in range(1, MAX_PICKS + 1)}
+        scored = []
+        for n in range(1, min(MAX_PICKS, len(offered)) + 1):
+            subsets = list(combinations(range(len(offered)), n))
+            products = []
+            for subset in subsets:
+                product = 1
+                for i in subset: product *= weights[i]
+                products.append(product)
+            total = sum(products)
+            scored += [(count_share[n] * product / total, subset) for subset, product in zip(subsets, products)]
+        scored.sort(key=lambda item: -item[0])
+        return [[offered[i] for i in subset] for _, subset in scored[:self.candidates]]
+
+    def allow(self, user_id, key_count=1):
+        # Takes one call from the user's hourly budget and the keys' shared per-minute budget, if both have room.
+        now = time.monotonic()
+        with self._lock:
+            user_calls = self._user_calls.setdefault(user_id, deque())
+            while user_calls and user_calls[0] <= now - 3600: user_calls.popleft()
+            while self._key_calls and self._key_calls[0] <= now - 60: self._key_calls.popleft()
+            if len(user_calls) >= self.user_calls_per_hour or len(self._key_calls) >= self.key_calls_per_minute * max(key_count, 1):
+                self.counts['over_budget'] += 1
+                return False
+            user_calls.append(now); self._key_calls.append(now)
+            self.counts['calls'] += 1
+            return True
+
+    def _expire(self, now):
+        for character_id in list(self.pending):
+            entries = self.pending[character_id]
+            for key in [k for k, (expires_at, _) in entries.items() if expires_at <= now]:
+                del entries[key]
+                self.counts['wasted'] += 1
+            if not entries: del self.pending[character_id]
+
+    def put(self, character_id, key, result):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self.pending.setdefault(character_id, {})[key] = (now + self.ttl, result)
+
+    def take(self, character_id, key):
+        # Consumes the character's speculation for this turn: the matching answer or None. Every other guess
+        # for the character is dropped as wasted, since the turn has moved past it.
+        with self._lock:
+            entries = self.pending.pop(character_id, None)
+            if not entries: return None
+            entry = entries.pop(key, None)
+            self.counts['wasted'] += len(entries)
+            if entry is None or entry[0] <= time.time():
+                self.counts['misses'] += 1
+                if entry is not None: self.counts['wasted'] += 1
+                return None
+            self.counts['hits'] += 1
+            return entry[1]
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            consumed = self.counts['hits'] + self.counts['misses']
+            return {
+                'enabled': self.enabled, 'candidates_per_turn': self.candidates,
+                'scheduled': self.counts['scheduled'], 'calls': self.counts['calls'], 'over_budget': self.counts['over_budget'],
+                'hits': self.counts['hits'], 'misses': self.counts['misses'], 'wasted_calls': self.counts['wasted'],
+                'hit_rate': round(self.counts['hits'] / consumed, 3) if consumed else None,
+                'pending': sum(len(entries) for entries in self.pending.values()),
+                'pick_counts': dict(self.pick_counts)
+            }
@@ -0,0 +1,88 @@
+"""Cold-start benchmark for web workers.
+
+Starts fresh Python processes and times what a newly spawned (autoscaled or pre-forked) worker goes through
+before it can answer: importing app.py, create_app(), and the first request. Also reports whether the heavy
+client libraries were loaded along the way, which they shouldn't be until a model call or /admin/stats needs them.
+
+    python startup_benchmark.py --runs 10
+    python startup_benchmark.py --runs 5 --top 15   # plus the slowest imports, from python -X importtime
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY_MODULES = ('google.generativeai', 'numpy')
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in each child process; prints one JSON line of timings in milliseconds.
+CHILD = """
+import sys, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app(%(config)r)
+created = time.perf_counter()
+status = flask_app.test_client().get(%(path)r).status_code
+answered = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (answered - created) * 1000, 'total_ms': (answered - started) * 1000,
+                  'status': status, 'heavy_loaded': [m for m in %(heavy)r if m in sys.modules]}))
+"""
+
+
+def run_child(config, path, extra_args=()):
+    code = CHILD % {'config': config, 'path': path, 'heavy': HEAVY_MODULES}
+    result = subprocess.run([sys.executable, *extra_args, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(config, path, top):
+    # (cumulative ms, module) for the top-level imports that took longest, from one run under -X importtime.
+    _, stderr = run_child(config, path, ('-X', 'importtime'))
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only modules imported directly by the child or by app.py itself; nested ones are counted in their parents.
+        if len(name) - len(name.lstrip()) <= 3: rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def run_benchmark(runs, config='production', path='/login', top=0):
+    samples = [run_child(config, path)[0] for _ in range(runs)]
+    report = {'runs': runs, 'config': config, 'path': path, 'status': samples[-1]['status'],
+              'heavy_loaded': sorted({m for s in samples for m in s['heavy_loaded']})}
+    for phase in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms'):
+        values = sorted(s[phase] for s in samples)
+        report[phase] = {'median': round(statistics.median(values), 1), 'min': round(values[0], 1), 'max': round(values[-1], 1)}
+    if top: report['slowest_imports'] = [{'module': name, 'ms': round(ms, 1)} for ms, name in slowest_imports(config, path, top)]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time a cold web worker: import app, create_app() and the first request.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--config', default=os.getenv("APP_ENV", "production"), help="APP_ENV name to create the app with")
+    parser.add_argument('--path', default='/login', help="the first request")
+    parser.add_argument('--top', type=int, default=0, help="also list the N slowest top-level imports")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.runs, args.config, args.path, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    for key, value in report.items():
+        if key == 'slowest_imports':
+            print(f"{key:>18}:")
+            for row in value: print(f"{'':>20}{row['ms']:>9.1f} ms  {row['module']}")
+        else:
+            print(f"{key:>18}: {value}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
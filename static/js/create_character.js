@@ -0,0 +1,43 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('creationForm');
+    const grid = document.getElementById('perksGrid');
+    const items = grid.querySelectorAll('.selection-item');
+    const maxSelections = 3;
+
+    grid.addEventListener('click', function(event) {
+        if (event.target.classList.contains('selection-item')) {
+            const selectedItems = grid.querySelectorAll('.selection-item.selected');
+            
+            if (event.target.classList.contains('selected')) {
+                event.target.classList.remove('selected');
+            } else {
+                if (selectedItems.length < maxSelections) {
+                    event.target.classList.add('selected');
+                } else {
+                    alert(`You can only select up to ${maxSelections} perks.`);
+                }
+            }
+        }
+    });
+
+    form.addEventListener('submit', function(event) {
+        // Clear previous hidden inputs
+        form.querySelectorAll('input[name="perks"]').forEach(input => input.remove());
+
+        const selectedItems = grid.querySelectorAll('.selection-item.selected');
+        
+        if (selectedItems.length !== maxSelections) {
+            alert(`Please select exactly ${maxSelections} perks.`);
+            event.preventDefault();
+            return;
+        }
+
+        selectedItems.forEach(item => {
+            const hiddenInput = document.createElement('input');
+            hiddenInput.type = 'hidden';
+            hiddenInput.name = 'perks';
+            hiddenInput.value = item.dataset.value;
+            form.appendChild(hiddenInput);
+        });
+    });
+});
@@ -0,0 +1,147 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Script for choice selection
+    const choicesForm = document.getElementById('choicesForm');
+    const simulationOverlay = document.getElementById('simulationOverlay');
+
+    if (choicesForm) {
+        const grid = document.getElementById('choicesGrid');
+        const maxSelections = 3;
+
+        grid.addEventListener('click', function(event) {
+            if (event.target.classList.contains('selection-item')) {
+                const selectedItems = grid.querySelectorAll('.selection-item.selected');
+                if (event.target.classList.contains('selected')) {
+                    event.target.classList.remove('selected');
+                } else {
+                    if (selectedItems.length < maxSelections) {
+                        event.target.classList.add('selected');
+                    } else {
+                        alert(`You can only select up to ${maxSelections} choices.`);
+                    }
+                }
+            }
+        });
+
+        choicesForm.addEventListener('submit', function(event) {
+            event.preventDefault(); // Prevent the form from submitting immediately
+
+            // Clear any previously added hidden inputs
+            choicesForm.querySelectorAll('input[name="choices"]').forEach(input => input.remove());
+            const selectedItems = grid.querySelectorAll('.selection-item.selected');
+            
+            if (selectedItems.length === 0) {
+                alert('You must make at least one choice to continue.');
+                return;
+            }
+
+            // Add selected choices as hidden inputs
+            selectedItems.forEach(item => {
+                const hiddenInput = document.createElement('input');
+                hiddenInput.type = 'hidden';
+                hiddenInput.name = 'choices';
+                hiddenInput.value = item.dataset.value;
+                choicesForm.appendChild(hiddenInput);
+            });
+
+            // Show the simulation pop-up; it stays up on the next page until the turn job finishes
+            if (simulationOverlay) {
+                simulationOverlay.classList.add('visible');
+            }
+            choicesForm.submit();
+        });
+    }
+
+    // Follow the background turn job and reload once the year has been written
+    if (simulationOverlay && simulationOverlay.dataset.statusUrl) {
+        const pollTurn = function() {
+            fetch(simulationOverlay.dataset.statusUrl, { credentials: 'same-origin' })
+                .then(response => response.json())
+                .then(status => {
+                    if (status.redirect) {
+                        window.location.href = status.redirect;
+                    } else {
+                        setTimeout(pollTurn, 1500);
+                    }
+                })
+                .catch(() => setTimeout(pollTurn, 3000));
+        };
+
+        // Stream the year as it is written; if the stream can't be opened, polling alone finishes the job
+        if (window.EventSource && simulationOverlay.dataset.eventsUrl) {
+            const narrative = document.getElementById('streamNarrative');
+            const details = document.getElementById('streamDetails');
+            const events = new EventSource(simulationOverlay.dataset.eventsUrl);
+            const restart = function() {
+                narrative.textContent = '';
+                details.textContent = '';
+            };
+            events.addEventListener('attempt', restart);
+            events.addEventListener('reset', restart);
+            events.addEventListener('narrative', event => {
+                narrative.textContent += JSON.parse(event.data).text;
+            });
+            events.addEventListener('attributes', event => {
+                const a = JSON.parse(event.data);
+                details.textContent = `Health ${a.health} · Happiness ${a.happiness}% · Karma ${a.karma} · IQ ${a.iq} · +${a.life_score} points`;
+            });
+            events.addEventListener('choices', () => {
+                details.textContent += ' · Your next choices are ready';
+            });
+            events.addEventListener('done', () => {
+                events.close();
+                pollTurn();
+            });
+            events.onerror = function() {
+                events.close();
+                setTimeout(pollTurn, 1500);
+            };
+        } else {
+            setTimeout(pollTurn, 1500);
+        }
+    }
+
+    // Load older years as the events log is scrolled to its end
+    const eventsLog = document.getElementById('eventsLog');
+    const eventsSentinel = document.getElementById('eventsSentinel');
+    if (eventsLog && eventsLog.dataset.timelineUrl && window.IntersectionObserver) {
+        let loading = false;
+        const loadOlder = function() {
+            if (loading || !eventsLog.dataset.nextCursor) return;
+            loading = true;
+            const url = `${eventsLog.dataset.timelineUrl}?after=${encodeURIComponent(eventsLog.dataset.nextCursor)}`;
+            fetch(url, { credentials: 'same-origin' })
+                .then(response => response.json())
+                .then(page => {
+                    page.events.forEach(event => {
+                        const entry = document.createElement('div');
+                        entry.className = 'event-entry';
+                        const title = document.createElement('h4');
+                        title.textContent = `Year ${event.year}`;
+                        const summary = document.createElement('p');
+                        summary.textContent = event.summary;
+                        entry.append(title, summary);
+                        eventsLog.insertBefore(entry, eventsSentinel);
+                    });
+                    eventsLog.dataset.nextCursor = page.next_cursor || '';
+                    if (!page.next_cursor) observer.disconnect();
+                })
+                .catch(() => {})
+                .finally(() => { loading = false; });
+        };
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadOlder();
+        }, { root: eventsLog, rootMargin: '200px' });
+        observer.observe(eventsSentinel);
+    }
+
+    // Script for End Life confirmation
+    const endLifeForm = document.getElementById('endLifeForm');
+    if(endLifeForm) {
+        endLifeForm.addEventListener('submit', function(event) {
+            const confirmation = confirm('Are you sure you want to end this character\'s life? This action cannot be undone.');
+            if (!confirmation) {
+                event.preventDefault();
+            }
+        });
+    }
+});
@@ -0,0 +1,32 @@
+import os
+from sqlalchemy import or_, and_
+from models import LifeEvent
+
+TIMELINE_PAGE_SIZE = int(os.getenv("TIMELINE_PAGE_SIZE", 20))
+TIMELINE_INITIAL_EVENTS = int(os.getenv("TIMELINE_INITIAL_EVENTS", 5))
+TIMELINE_MAX_PAGE_SIZE = 100
+
+def parse_cursor(cursor):
+    # "year:id" of the last event on the previous page.
+    try:
+        year, event_id = (int(part) for part in cursor.split(':'))
+        return year, event_id
+    except (AttributeError, ValueError): return None
+
+def timeline_page(character_id, cursor=None, page_size=None):
+    # Keyset pagination over (year desc, id desc), newest first; served by ix_life_event_character_year, whose
+    # entries end in the rowid. A year can hold two events (a death adds one), hence the id tiebreak.
+    # Returns (rows, next_cursor).
+    page_size = max(1, min(page_size or TIMELINE_PAGE_SIZE, TIMELINE_MAX_PAGE_SIZE))
+    query = LifeEvent.query.filter(LifeEvent.character_id == character_id)
+    after = parse_cursor(cursor)
+    if after:
+        year, event_id = after
+        query = query.filter(or_(LifeEvent.year < year, and_(LifeEvent.year == year, LifeEvent.id < event_id)))
+    events = query.order_by(LifeEvent.year.desc(), LifeEvent.id.desc()).limit(page_size + 1).all()
+    rows = [{'id': e.id, 'year': e.year, 'summary': e.summary} for e in events[:page_size]]
+    next_cursor = None
+    if len(events) > page_size:
+        last = events[page_size - 1]
+        next_cursor = f"{last.year}:{last.id}"
+    return rows, next_cursor
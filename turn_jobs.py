@@ -0,0 +1,191 @@
+import json
+import time
+import threading
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from models import db, TurnJob
+
+ACTIVE_STATES = ('queued', 'running')
+
+
+class TurnError(Exception):
+    # A retryable turn failure; the message is shown to the player once retries run out.
+    pass
+
+
+class JobReleased(Exception):
+    # The job was failed as stale while its worker was still running it; that worker's turn must not be written.
+    pass
+
+
+class TurnStream:
+    # Progress events of one job run in this process. They are kept until shortly after the job ends, so a
+    # listener that connects late replays what it missed, and each listener waits on the job's own condition.
+    def __init__(self):
+        self.events = []
+        self.closed_at = None
+        self.cond = threading.Condition()
+
+    def publish(self, event, data, close=False):
+        with self.cond:
+            self.events.append((event, data))
+            if close: self.closed_at = time.monotonic()
+            self.cond.notify_all()
+
+    def wait(self, cursor, timeout):
+        # Returns (events after cursor, closed), blocking up to timeout while there is nothing new.
+        with self.cond:
+            if len(self.events) <= cursor and self.closed_at is None: self.cond.wait(timeout)
+            return self.events[cursor:], self.closed_at is not None
+
+
+class TurnQueue:
+    # Runs the slow, LLM-bound turn pipeline on a thread pool so request workers return immediately.
+    # Jobs are rows in the turn_job table, so the poller, the worker and a page reload all see the same state.
+    def __init__(self, app=None):
+        self.handlers = {}
+        self.executor = None
+        self.streams = {}
+        self.listeners = 0
+        self._streams_lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_attempts = app.config.get('TURN_MAX_ATTEMPTS', 3)
+        self.retry_delay = app.config.get('TURN_RETRY_DELAY', 1.0)
+        self.stale_after = timedelta(seconds=app.config.get('TURN_JOB_TIMEOUT', 300))
+        self.stream_retention = app.config.get('TURN_STREAM_RETENTION', 60)
+        self.executor = ThreadPoolExecutor(max_workers=app.config.get('TURN_WORKERS', 4), thread_name_prefix='turn-worker')
+        app.extensions['turn_queue'] = self
+
+    def handler(self, kind):
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def active_job(self, character_id):
+        job = TurnJob.query.filter(TurnJob.character_id == character_id, TurnJob.state.in_(ACTIVE_STATES)).order_by(TurnJob.id.desc()).first()
+        if job and datetime.utcnow() - job.updated_at > self.stale_after:
+            # The worker that owned this job died with the process, or is stuck; release the character. Only if the
+            # job hasn't moved on since it was read, and hold() keeps a worker that is still alive from writing its turn.
+            released = TurnJob.query.filter_by(id=job.id, state=job.state, updated_at=job.updated_at).update(
+                {'state': 'failed', 'category': 'danger', 'message': "The story could not continue. Please try again."}, synchronize_session=False)
+            db.session.commit()
+            if released: return None
+            return job if job.state in ACTIVE_STATES else None
+        return job
+
+    def hold(self, job):
+        # Called inside a turn's transaction right before it commits: the turn may only be written while its job is
+        # still running. A job active_job() has failed as stale may already have a successor advancing the character.
+        held = TurnJob.query.filter_by(id=job.id, state='running').update({'updated_at': datetime.utcnow()}, synchronize_session=False)
+        if not held:
+            db.session.rollback()
+            raise JobReleased(f"Turn job {job.id} was released while it was running.")
+
+    def enqueue(self, kind, user_id, character_id, idempotency_key, payload=None):
+        active = self.active_job(character_id)
+        existing = TurnJob.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing and existing.state != 'failed': return existing
+        if existing:
+            # A failed job leaves the character where it was, so a retry builds the same key; release it.
+            existing.idempotency_key = f"{idempotency_key}:failed:{existing.id}"
+            db.session.commit()
+        if active: return active
+        job = TurnJob(kind=kind, user_id=user_id, character_id=character_id, idempotency_key=idempotency_key, payload=json.dumps(payload or {}))
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent double-submit won the race for this key.
+            db.session.rollback()
+            return TurnJob.query.filter_by(idempotency_key=idempotency_key).first()
+        with self._streams_lock:
+            self.streams[job.id] = TurnStream()
+        self.executor.submit(self._run, job.id)
+        return job
+
+    def publish(self, job_id, event, data, close=False):
+        with self._streams_lock:
+            stream = self.streams.get(job_id)
+            if close:
+                # Drop the streams of jobs that ended long enough ago that nobody is still catching up.
+                cutoff = time.monotonic() - self.stream_retention
+                for old_id in [i for i, s in self.streams.items() if s.closed_at is not None and s.closed_at < cutoff]:
+                    del self.streams[old_id]
+        if stream: stream.publish(event, data, close)
+
+    def listen(self, job_id, heartbeat=15.0, poll_interval=2.0):
+        # Yields a job's (event, data) pairs until it ends with a 'done' event, and (None, None) as a keep-alive
+        # when nothing happened for heartbeat seconds. A job run by another process has no stream here, so only
+        # its end is reported, read from the database. No database connection is held while waiting.
+        with self._streams_lock:
+            stream = self.streams.get(job_id)
+            self.listeners += 1
+        try:
+            if stream is None:
+                while True:
+                    job = db.session.get(TurnJob, job_id)
+                    state = job.state if job else 'failed'
+                    db.session.remove()
+                    if state not in ACTIVE_STATES:
+                        yield 'done', {'state': state}
+                        return
+                    yield None, None
+                    time.sleep(poll_interval)
+            cursor = 0
+            while True:
+                events, closed = stream.wait(cursor, heartbeat)
+                if not events and not closed: yield None, None
+                for event in events: yield event
+                cursor += len(events)
+                if closed: return
+        finally:
+            with self._streams_lock:
+                self.listeners -= 1
+
+    def _claim(self, job_id):
+        claimed = TurnJob.query.filter_by(id=job_id, state='queued').update({'state': 'running', 'updated_at': datetime.utcnow()})
+        db.session.commit()
+        return db.session.get(TurnJob, job_id) if claimed else None
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = self._claim(job_id)
+            if job is None:
+                self.publish(job_id, 'done', {'state': None}, close=True)
+                return
+            handler, payload = self.handlers[job.kind], json.loads(job.payload or '{}')
+            while True:
+                job.attempts += 1
+                db.session.commit()
+                self.publish(job.id, 'attempt', {'attempt': job.attempts})
+                try:
+                    result = handler(job, payload)
+                except JobReleased:
+                    db.session.rollback()
+                    self.publish(job.id, 'done', {'state': 'failed'}, close=True)
+                    return
+                except TurnError as e:
+                    db.session.rollback()
+                    if job.attempts < self.max_attempts:
+                        time.sleep(self.retry_delay * job.attempts)
+                        continue
+                    state, category, message = 'failed', 'danger', str(e)
+                except Exception:
+                    traceback.print_exc()
+                    db.session.rollback()
+                    state, category, message = 'failed', 'danger', "The story could not continue. Please try again."
+                else:
+                    state, (category, message) = 'done', result or (None, None)
+                break
+            # Conditional, so a job failed as stale in the meantime keeps that state.
+            if not TurnJob.query.filter_by(id=job.id, state='running').update({'state': state, 'category': category, 'message': message}):
+                db.session.rollback()
+                state = 'failed'
+            db.session.commit()
+            self.publish(job.id, 'done', {'state': state}, close=True)